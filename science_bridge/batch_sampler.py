@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+import common
+import numpy as np
+import randomness
+import sys
+import table
+import time
+
+
+# Like naive_sampler, but produces deals in batches, as numpy arrays.
+# A batch of n deals is an array of shape (n, 52) and dtype uint8, where each row
+# is a deal in the usual layout: North's cards first, then East, South, West.
+#
+# The functions take an `rng` with the integers() method of a numpy Generator.
+# The samplers pass a RandomnessGenerator, so that all randomness still comes
+# from randomness.py (the operating system, unless seeded), and not from a
+# numpy PRNG.
+
+DEFAULT_BATCH_SIZE = 65536
+
+CARDS = np.arange(52, dtype=np.uint32)
+# Each suit gets its own byte, so summing over a hand counts all suits at once.
+SUIT_BITS = np.array([1 << (8 * (card // 13)) for card in range(52)], dtype=np.uint32)
+SUIT_SHIFTS = np.array([0, 8, 16, 24], dtype=np.uint32)
+CARDS_BY_SUIT = np.arange(52, dtype=np.uint8).reshape(4, 13)
+HPC_BY_CARD = np.array([max(0, card % 13 - 8) for card in range(52)], dtype=np.uint8)
+
+
+class RandomnessGenerator:
+    # The part of numpy's Generator interface used here, with all bytes taken
+    # from randomness.randbytes().
+
+    def integers(self, low, high, size, dtype):
+        """
+        Returns an array of shape `size` with uniformly random integers in
+        range(low, high). Like randomness.randbelow(), each value takes just
+        enough bits, and values that are too large are drawn again, so every
+        value is *exactly* uniform.
+        """
+        span = high - low
+        assert 0 < span <= 1 << 64
+        bits = (span - 1).bit_length()
+        raw_dtype = np.dtype('<u4') if bits <= 32 else np.dtype('<u8')
+        mask = raw_dtype.type((1 << bits) - 1)
+
+        def draw(count):
+            return np.frombuffer(randomness.randbytes(raw_dtype.itemsize * count), dtype=raw_dtype) & mask
+
+        values = draw(int(np.prod(size)))
+        if span != 1 << bits:
+            # Otherwise, every value is in range.
+            redraw = np.flatnonzero(values >= span)
+            while redraw.size > 0:
+                values[redraw] = draw(redraw.size)
+                redraw = redraw[values[redraw] >= span]
+        return (values + low).astype(dtype, copy=False).reshape(size)
+
+
+def generate_deal_batch(n, rng):
+    """
+    Returns n uniformly random deals as an array of shape (n, 52).
+    `rng` is a RandomnessGenerator (or a numpy Generator).
+    """
+    # Sort random keys, and carry the card along in the lowest 6 bits. If two
+    # keys of the same row collide in the random part, the order would depend on
+    # the card index, so these (very few) rows are drawn again. This keeps the
+    # permutation *exactly* uniform.
+    keys = rng.integers(0, 1 << 32, size=(n, 52), dtype=np.uint32)
+    keys &= np.uint32(0xffffffc0)
+    keys |= CARDS
+    keys.sort(axis=1)
+    random_part = keys >> 6
+    tied = (random_part[:, 1:] == random_part[:, :-1]).any(axis=1)
+    deals = (keys & 63).astype(np.uint8)
+    num_tied = int(tied.sum())
+    if num_tied > 0:
+        deals[tied] = generate_deal_batch(num_tied, rng)
+    return deals
+
+
+def shuffle_rows(rows, rng):
+    """
+    Returns a copy of `rows` (an array of shape (n, k) with entries below 256)
+    with each row permuted uniformly at random, independently of the others.
+    """
+    # Same trick as in generate_deal_batch(), but carrying the column index.
+    n, k = rows.shape
+    assert k <= 64
+    keys = rng.integers(0, 1 << 32, size=(n, k), dtype=np.uint32)
+    keys &= np.uint32(0xffffffc0)
+    keys |= CARDS[:k]
+    keys.sort(axis=1)
+    random_part = keys >> 6
+    tied = (random_part[:, 1:] == random_part[:, :-1]).any(axis=1)
+    shuffled = np.take_along_axis(rows, (keys & 63).astype(np.intp), axis=1)
+    if tied.any():
+        shuffled[tied] = shuffle_rows(rows[tied], rng)
+    return shuffled
+
+
+def deal_batch_4suits(count_4suits, n, rng, seats='NESW'):
+    """
+    Returns n deals as an array of shape (n, 13 * len(seats)), where North has
+    exactly `count_4suits` cards of each suit. Each row has the same distribution
+    as common.sample_deal_4suits(count_4suits, seats): North's cards grouped by
+    suit (in random order within each suit), then the cards of the other seats in
+    random order.
+    """
+    assert len(count_4suits) == 4 and sum(count_4suits) == 13
+    north = []
+    rest = []
+    for suit, suit_count in enumerate(count_4suits):
+        suit_cards = shuffle_rows(np.broadcast_to(CARDS_BY_SUIT[suit], (n, 13)), rng)
+        north.append(suit_cards[:, :suit_count])
+        rest.append(suit_cards[:, suit_count:])
+    if seats == 'N':
+        return np.hstack(north)
+    # For 'NS', South is the first 13 of the remaining cards in random order.
+    return np.hstack(north + [shuffle_rows(np.hstack(rest), rng)[:, :13 * (len(seats) - 1)]])
+
+
+def sample_stratified_4suits(prepared, n, rng, seats='NESW'):
+    """
+    Returns a tuple (deals, key_indices): n deals with the given `seats` (see
+    common.SEATS) as an array of shape (n, 13 * len(seats)),
+    where North's suit lengths follow the table `prepared` (see
+    table.prepare_table_int(), with keys (c, d, h, s)), and for each deal the
+    index of its key in `prepared`.
+    The deals have the same distribution as n calls of table.sample_prepared_int()
+    followed by common.sample_deal_4suits(), but all deals of the same shape are
+    dealt at once.
+    """
+    keys, cumulative = prepared
+    assert cumulative[-1] < 1 << 63
+    # Drawing the key of each deal independently gives the multinomial counts per
+    # shape, *and* a uniformly random order of the deals. Both are exact.
+    chosen = rng.integers(0, cumulative[-1], size=n, dtype=np.int64)
+    key_indices = np.searchsorted(np.array(cumulative, dtype=np.int64), chosen, side='right')
+    deals = np.empty((n, 13 * len(seats)), dtype=np.uint8)
+    order = np.argsort(key_indices, kind='stable')
+    counts = np.bincount(key_indices, minlength=len(keys))
+    start = 0
+    for key_idx in np.flatnonzero(counts).tolist():
+        end = start + int(counts[key_idx])
+        deals[order[start:end]] = deal_batch_4suits(keys[key_idx], end - start, rng, seats)
+        start = end
+    return deals, key_indices
+
+
+def generate_deal_batches(batch_size=DEFAULT_BATCH_SIZE, rng=None):
+    if rng is None:
+        # Also reproducible if randomness.seed() was called.
+        rng = RandomnessGenerator()
+    while True:
+        yield generate_deal_batch(batch_size, rng)
+
+
+def count_suits(deals):
+    """
+    Returns an array of shape (n, 4, 4), where [i, hand, suit] is the number of
+    cards of that suit in that hand of deal i.
+    """
+    n = deals.shape[0]
+    packed = SUIT_BITS[deals].reshape(n, 4, 13).sum(axis=2, dtype=np.uint32)
+    return ((packed[:, :, np.newaxis] >> SUIT_SHIFTS) & 0xff).astype(np.uint8)
+
+
+def count_hpc(deals):
+    """
+    Returns an array of shape (n, 4), where [i, hand] is the HPC of that hand of deal i.
+    """
+    n = deals.shape[0]
+    return HPC_BY_CARD[deals].reshape(n, 4, 13).sum(axis=2, dtype=np.uint8)
+
+
+def run_sanity_checks():
+    print('Running sanity checks ...', file=sys.stderr)
+    # Also for ranges that aren't a power of 2, where some values are drawn again.
+    values = RandomnessGenerator().integers(0, 3, size=30000, dtype=np.int64)
+    assert values.shape == (30000,) and values.dtype == np.int64 and values.max() < 3
+    assert (np.bincount(values, minlength=3) > 9000).all()
+    deals = generate_deal_batch(1000, RandomnessGenerator())
+    assert deals.shape == (1000, 52) and deals.dtype == np.uint8
+    assert (np.sort(deals, axis=1) == np.arange(52)).all()
+    suit_counts = count_suits(deals)
+    hpcs = count_hpc(deals)
+    for deal, deal_suit_counts, deal_hpcs in zip(deals[:50].tolist(), suit_counts[:50], hpcs[:50]):
+        for hand in range(4):
+            hand_cards = deal[13 * hand:13 * (hand + 1)]
+            assert [sum(1 for card in hand_cards if common.card_suit(card) == suit) for suit in range(4)] == list(deal_suit_counts[hand])
+            assert common.count_hpc(hand_cards) == deal_hpcs[hand]
+    assert (suit_counts.sum(axis=2) == 13).all()
+    assert (hpcs.sum(axis=1, dtype=np.uint32) == 40).all()
+    rng = RandomnessGenerator()
+    prepared = table.prepare_table_int(table.compute_table_4suits_int((1, 3, 3, 5, 3, 7, 3, 6)))
+    deals, key_indices = sample_stratified_4suits(prepared, 1000, rng)
+    assert deals.shape == (1000, 52) and deals.dtype == np.uint8
+    assert (np.sort(deals, axis=1) == np.arange(52)).all()
+    north_suit_counts = count_suits(deals)[:, 0, :]
+    for deal_suit_counts, key_idx in zip(north_suit_counts.tolist(), key_indices.tolist()):
+        assert tuple(deal_suit_counts) == prepared[0][key_idx]
+    # North's cards are grouped by suit, as with common.sample_deal_4suits().
+    assert (np.diff(deals[:, :13] // 13, axis=1) >= 0).all()
+    # Every card is equally likely at each position: Card c is one of North's
+    # with probability count_4suits[suit] / 13, and else one of the other 39.
+    count_4suits = (4, 3, 3, 3)
+    deals = deal_batch_4suits(count_4suits, 52000, rng)
+    for position in (0, 13, 51):
+        position_counts = np.bincount(deals[:, position].astype(np.intp), minlength=52)
+        for card in range(52):
+            suit_count = count_4suits[card // 13]
+            if position < 13:
+                in_suit = sum(count_4suits[:card // 13]) <= position < sum(count_4suits[:card // 13 + 1])
+                expected = 52000 / 13 if in_suit else 0
+            else:
+                expected = 52000 * (13 - suit_count) / 13 / 39
+            assert abs(position_counts[card] - expected) <= 5 * expected ** 0.5, (position, card, position_counts[card], expected)
+    # Partial deals are a prefix of what a whole deal could have been.
+    for seats in ('N', 'NS'):
+        deals, key_indices = sample_stratified_4suits(prepared, 1000, rng, seats)
+        assert deals.shape == (1000, 13 * len(seats))
+        assert all(len(set(deal)) == 13 * len(seats) for deal in deals.tolist())
+        north_suits = (deals[:, :13] // 13).astype(np.intp)
+        for suit in range(4):
+            assert ((north_suits == suit).sum(axis=1) == [prepared[0][key_idx][suit] for key_idx in key_indices.tolist()]).all()
+    print('  Done', file=sys.stderr)
+
+
+def do_time_self(batch_size=DEFAULT_BATCH_SIZE):
+    total = 0
+    start_time = time.time()
+    for deals in generate_deal_batches(batch_size):
+        count_suits(deals)
+        count_hpc(deals)
+        total += deals.shape[0]
+        print('{} deals, about {}/s'.format(total, total / (time.time() - start_time)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    run_sanity_checks()
+    do_time_self()
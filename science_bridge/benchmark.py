@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+import common
+import deal_stream
+import formats
+import hpc_sampler
+import json
+import naive_sampler
+import os
+import platform
+import randomness
+import sys
+import table
+import table_cache
+import time
+
+# Repeatable benchmarks of the samplers, the table construction, and the output
+# formats. Each benchmark does a fixed amount of work with a fixed seed, so runs
+# on different commits are directly comparable:
+#
+#     ./benchmark.py > before.json
+#     ... change something ...
+#     ./benchmark.py > after.json
+#     ./benchmark.py --compare before.json after.json
+
+BENCHMARK_VERSION = 1
+CONSTRAINTS = {
+    # Any HPC
+    'easy': (0, 13, 0, 13, 0, 13, 0, 13, 0, 37),
+    # A strong notrump opening with a five-card spade suit
+    'medium': (0, 13, 0, 13, 0, 13, 5, 13, 15, 17),
+    # The example from the README, about 1 in 700 hands with these suit lengths
+    'tight': (0, 2, 3, 4, 3, 5, 3, 5, 26, 30),
+}
+SUIT_CONSTRAINTS = (1, 3, 3, 5, 3, 7, 3, 6)
+# The multi_sampler example from the README: South has at least 4 hearts.
+HANDS_CONSTRAINTS = ((1, 3, 3, 5, 3, 6, 3, 6), None, (0, 13, 0, 13, 4, 13, 0, 13), None)
+FORMATS = [fmt for fmt in formats.FORMATS if fmt != 'None']
+
+
+def clear_table_caches():
+    hpc_sampler.compute_suit_weights.cache_clear()
+    hpc_sampler.compute_suffix_weights.cache_clear()
+    hpc_sampler.prepare_suit_holdings.cache_clear()
+    table.memoized_count_table_4suits_points.cache_clear()
+    table.memoized_compute_table_4suits_points.cache_clear()
+    table.memoized_count_table_hands.cache_clear()
+    table.memoized_hands_state.cache_clear()
+
+
+def measure(name, run, info):
+    """
+    Seeds randomness, calls `run()`, which returns a tuple (deals, tries) (both
+    may be None), and returns the result as a dict.
+    """
+    randomness.seed('benchmark/' + name)
+    start = time.perf_counter()
+    deals, tries = run()
+    seconds = time.perf_counter() - start
+    result = dict(info, name=name, seconds=seconds)
+    if deals is not None:
+        result['deals'] = deals
+        result['deals_per_second'] = deals / seconds
+    if tries is not None:
+        result['tries'] = tries
+        result['tries_per_second'] = tries / seconds
+    print('{}: {:.3f} s'.format(name, seconds), file=sys.stderr)
+    return result
+
+
+# Each gen_*_benchmarks() yields tuples (name, run, info), see measure(). The
+# preparation that isn't measured happens lazily, just before yielding.
+
+def run_naive(n):
+    gen = naive_sampler.generate_deals()
+    for _ in range(n):
+        next(gen)
+    return n, n
+
+
+def run_sampler(sampler, n):
+    _, _, tries = deal_stream.sample_batch(sampler, n)
+    return n, tries
+
+
+def run_batch(n):
+    # Only needs numpy if actually used.
+    import batch_sampler
+    batch_sampler.generate_deal_batch(n, batch_sampler.RandomnessGenerator())
+    return n, n
+
+
+def run_table(compute):
+    clear_table_caches()
+    compute()
+    return None, None
+
+
+def gen_table_benchmarks(scale):
+    yield 'table/4suits_int', lambda: run_table(lambda: table.compute_table_4suits_int(SUIT_CONSTRAINTS)), {'constraints': SUIT_CONSTRAINTS}
+    yield 'table/4suits_points_hpc', lambda: run_table(lambda: table.count_table_4suits_points(table.evaluate_hpc)), {}
+    yield 'table/hands_2', lambda: run_table(lambda: table.count_table_hands(2)), {}
+    for difficulty, min_max_reqs in CONSTRAINTS.items():
+        yield ('table/4suits_hpc/' + difficulty,
+               lambda min_max_reqs=min_max_reqs: run_table(lambda: hpc_sampler.compute_table_4suits_hpc(min_max_reqs)),
+               {'constraints': min_max_reqs})
+
+
+def gen_sampler_benchmarks(scale):
+    yield 'sampler/naive', lambda: run_naive(20000 * scale), {}
+    yield 'sampler/batch', lambda: run_batch(200000 * scale), {}
+    sampler = deal_stream.prepare(SUIT_CONSTRAINTS)
+    yield 'sampler/table', lambda: run_sampler(sampler, 20000 * scale), {'constraints': SUIT_CONSTRAINTS}
+    for seats in ('NS', 'N'):
+        sampler = deal_stream.prepare(SUIT_CONSTRAINTS, seats=seats)
+        yield 'sampler/table/' + seats, lambda sampler=sampler: run_sampler(sampler, 20000 * scale), {'constraints': SUIT_CONSTRAINTS}
+    sampler = deal_stream.prepare(SUIT_CONSTRAINTS, method='stratified')
+    yield 'sampler/table/stratified', lambda: run_sampler(sampler, 100000 * scale), {'constraints': SUIT_CONSTRAINTS}
+    sampler = deal_stream.prepare_hands(HANDS_CONSTRAINTS)
+    yield 'sampler/hands', lambda: run_sampler(sampler, 20000 * scale), {'constraints': HANDS_CONSTRAINTS}
+    for difficulty, min_max_reqs in CONSTRAINTS.items():
+        sampler = deal_stream.prepare(min_max_reqs, method='exact')
+        yield ('sampler/combined/exact/' + difficulty,
+               lambda sampler=sampler: run_sampler(sampler, 20000 * scale),
+               {'constraints': min_max_reqs})
+    # The Monte Carlo sampler needs only a few tries per deal for 'easy' and
+    # 'medium', but thousands for 'tight', hence fewer deals.
+    for difficulty, n in [('easy', 5000), ('medium', 2000), ('tight', 20)]:
+        sampler = deal_stream.prepare(CONSTRAINTS[difficulty], method='monte-carlo')
+        yield ('sampler/combined/monte-carlo/' + difficulty,
+               lambda sampler=sampler, n=n: run_sampler(sampler, n * scale),
+               {'constraints': CONSTRAINTS[difficulty]})
+
+
+def gen_format_benchmarks(scale):
+    randomness.seed('benchmark/format/deals')
+    deals = [common.sample_deal_by_rank() for _ in range(5000 * scale)]
+
+    def run_format(fmt):
+        formats.format_deals(deals, fmt)
+        return len(deals), None
+
+    for fmt in FORMATS:
+        # Builds the lookup tables of formats.py, if any.
+        formats.format_deals(deals[:1], fmt)
+        yield 'format/' + fmt, lambda fmt=fmt: run_format(fmt), {}
+
+
+def run_benchmarks(scale=1, name_filter=''):
+    # Only measure what the code does, not what happens to be in the table cache.
+    os.environ.pop(table_cache.CACHE_ENV_VAR, None)
+    results = []
+    for gen_benchmarks in (gen_table_benchmarks, gen_sampler_benchmarks, gen_format_benchmarks):
+        for name, run, info in gen_benchmarks(scale):
+            if name_filter in name:
+                results.append(measure(name, run, info))
+    return {
+        'version': BENCHMARK_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+
+def compare(filename_before, filename_after):
+    with open(filename_before) as fp:
+        before = {result['name']: result for result in json.load(fp)['results']}
+    with open(filename_after) as fp:
+        after = {result['name']: result for result in json.load(fp)['results']}
+    for name, result in after.items():
+        if name not in before:
+            print('{:45} (new) {:.3f} s'.format(name, result['seconds']))
+            continue
+        if 'deals_per_second' in result and 'deals_per_second' in before[name]:
+            # Also works if the two runs had a different --scale.
+            ratio = result['deals_per_second'] / before[name]['deals_per_second']
+        else:
+            ratio = before[name]['seconds'] / result['seconds']
+        print('{:45} {:.3f} s -> {:.3f} s ({:.2f}x {})'.format(name, before[name]['seconds'], result['seconds'], ratio, 'faster' if ratio >= 1 else 'slower'))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) == 3 and args[0] == '--compare':
+        compare(args[1], args[2])
+        exit(0)
+    scale = 1
+    name_filter = ''
+    while args:
+        if args[0] == '--scale' and len(args) >= 2:
+            scale = int(args[1])
+        elif args[0] == '--filter' and len(args) >= 2:
+            name_filter = args[1]
+        else:
+            print('USAGE: {} [--scale N] [--filter SUBSTRING]'.format(sys.argv[0]), file=sys.stderr)
+            print('   or: {} --compare <BEFORE_JSON> <AFTER_JSON>'.format(sys.argv[0]), file=sys.stderr)
+            print('Runs all benchmarks (N times the default amount of work) and prints the results as JSON.', file=sys.stderr)
+            exit(1)
+        args = args[2:]
+    json.dump(run_benchmarks(scale, name_filter), sys.stdout, indent=1)
+    print()
@@ -2,11 +2,16 @@
 # -*- encoding=utf-8 -*-
 
 import fractions
-import random
-import secrets
+import metrics
+import mmap
+import os
+import randomness
+import tempfile
+import time
 
 SUITS = '♣♦♥♠'
 RANKS = '23456789⑩JQKA'
+HONORS_PER_SUIT = 4  # J, Q, K, A
 FACTORIALS = [1]
 
 for i in range(1, 52 + 1):
@@ -28,6 +33,21 @@ def subset_probability(n, t, g, d):
     return fractions.Fraction(num, denom)
 
 
+def hand_2suit_count(c, d):
+    # Number of hands with exactly c clubs and d diamonds
+    assert 0 <= c <= 13
+    assert 0 <= d <= 13
+    assert 0 <= c + d <= 13
+    return binomial(13, c) * binomial(13, d) * binomial(52 - 13 - 13, 13 - c - d)
+
+
+def hand_4suit_count(c, d, h, s):
+    # Number of hands with exactly these suit lengths
+    assert all(0 <= x <= 13 for x in (c, d, h, s))
+    assert c + d + h + s == 13
+    return binomial(13, c) * binomial(13, d) * binomial(13, h) * binomial(13, s)
+
+
 def hand_2suit_probability(c, d):
     # Follows from subset_probability(…)
     assert 0 <= c <= 13
@@ -72,15 +92,300 @@ def deal_to_string(deal):
     return '   '.join(' '.join(card_to_string(card) for card in hand) for hand in display_deal)
 
 
+def string_to_card(card_string):
+    assert len(card_string) == 2, card_string
+    return SUITS.index(card_string[0]) * 13 + RANKS.index(card_string[1])
+
+
+def string_to_deal(deal_string):
+    # Inverse of deal_to_string()
+    deal = [string_to_card(card_string) for hand in deal_string.strip().split('   ') for card_string in hand.split(' ')]
+    assert len(deal) == 52, deal_string
+    return deal
+
+
+# Binary formats. Both describe, for each card 0..51, which hand (0 = North,
+# 1 = East, 2 = South, 3 = West) holds it:
+# - 'bin52' uses one byte per card, so 52 bytes per deal.
+# - 'bin13' packs 4 cards into each byte, 2 bits per card (card 4*i+j is in bits
+#   2*j and 2*j+1 of byte i), so 13 bytes per deal.
+BINARY_RECORD_SIZES = {'bin52': 52, 'bin13': 13}
+
+
+def deal_to_hands(deal):
+    assert len(deal) == 52
+    hands = bytearray(52)
+    for position, card in enumerate(deal):
+        hands[card] = position // 13
+    return hands
+
+
+def hands_to_deal(hands):
+    assert len(hands) == 52
+    deal = []
+    for hand in range(4):
+        deal.extend(card for card in range(52) if hands[card] == hand)
+    assert len(deal) == 52
+    return deal
+
+
+def encode_deal_bin52(deal):
+    return bytes(deal_to_hands(deal))
+
+
+def encode_deal_bin13(deal):
+    hands = deal_to_hands(deal)
+    return bytes(hands[i] | (hands[i + 1] << 2) | (hands[i + 2] << 4) | (hands[i + 3] << 6) for i in range(0, 52, 4))
+
+
+def decode_deal_bin52(record):
+    return hands_to_deal(record)
+
+
+def decode_hands_bin13(record):
+    # Like decode_deal_bin13(), but returns for each card the hand that holds it, see deal_to_hands().
+    assert len(record) == 13
+    return [(byte >> shift) & 3 for byte in record for shift in (0, 2, 4, 6)]
+
+
+def decode_deal_bin13(record):
+    return hands_to_deal(decode_hands_bin13(record))
+
+
+# Ranks: Each hand (a set of 13 cards) has a unique index in [0, HANDS_COUNT),
+# and each deal a unique index in [0, DEALS_COUNT). So "deal #N" is well-defined,
+# a uniformly random deal is just unrank_deal(randbelow(DEALS_COUNT)), and
+# disjoint ranges of ranks give disjoint sets of deals.
+#
+# A hand is ranked by the combinatorial number system: the sorted cards
+# c_0 < ... < c_12 have rank sum(binomial(c_i, i + 1)). A deal is ranked by
+# North's hand among all 52 cards, East's hand among the remaining 39 cards, and
+# South's hand among the remaining 26 cards; West gets the rest.
+# - 'bin12' stores the rank of a deal as 12 bytes big-endian, so files sort the
+#   same way as ranks.
+
+# BINOMIALS[n][k] == binomial(n, k) for all 0 <= n <= 52 and 0 <= k <= 13, and 0 if k > n.
+BINOMIALS = [[binomial(n, k) if k <= n else 0 for k in range(13 + 1)] for n in range(52 + 1)]
+HANDS_COUNT = BINOMIALS[52][13]
+DEALS_COUNT = BINOMIALS[52][13] * BINOMIALS[39][13] * BINOMIALS[26][13]
+BINARY_RECORD_SIZES['bin12'] = 12
+assert DEALS_COUNT < 1 << (8 * BINARY_RECORD_SIZES['bin12'])
+
+
+def rank_hand(cards):
+    """
+    Returns the rank of the hand in [0, binomial(n, 13)), where `cards` are 13
+    distinct integers in [0, n), in any order.
+    """
+    assert len(cards) == 13
+    return sum(BINOMIALS[card][i + 1] for i, card in enumerate(sorted(cards)))
+
+
+def unrank_hand(rank, n=52):
+    """
+    Returns the sorted list of 13 cards in [0, n) with the given rank, see rank_hand().
+    """
+    assert 0 <= rank < BINOMIALS[n][13]
+    cards = [0] * 13
+    card = n - 1
+    for i in range(13, 0, -1):
+        while BINOMIALS[card][i] > rank:
+            card -= 1
+        rank -= BINOMIALS[card][i]
+        cards[i - 1] = card
+        card -= 1
+    return cards
+
+
+def rank_deal(deal):
+    """
+    Returns the rank of the deal in [0, DEALS_COUNT).
+    """
+    hands = deal_to_hands(deal)
+    rank_n = rank_e = rank_s = 0
+    seen_n = seen_e = seen_s = 0
+    for card in range(52):
+        hand = hands[card]
+        if hand == 0:
+            seen_n += 1
+            rank_n += BINOMIALS[card][seen_n]
+            continue
+        # Position of `card` among the cards that North doesn't hold:
+        index_e = card - seen_n
+        if hand == 1:
+            seen_e += 1
+            rank_e += BINOMIALS[index_e][seen_e]
+        elif hand == 2:
+            # Position of `card` among the cards that neither North nor East hold:
+            seen_s += 1
+            rank_s += BINOMIALS[index_e - seen_e][seen_s]
+    return (rank_n * BINOMIALS[39][13] + rank_e) * BINOMIALS[26][13] + rank_s
+
+
+def unrank_deal(rank):
+    """
+    Returns the deal with the given rank, see rank_deal(). Each hand is sorted.
+    """
+    assert 0 <= rank < DEALS_COUNT
+    rank, rank_s = divmod(rank, BINOMIALS[26][13])
+    rank_n, rank_e = divmod(rank, BINOMIALS[39][13])
+    remaining = list(range(52))
+    deal = []
+    for hand_rank in (rank_n, rank_e, rank_s):
+        positions = unrank_hand(hand_rank, len(remaining))
+        deal.extend(remaining[position] for position in positions)
+        for position in reversed(positions):
+            del remaining[position]
+    deal.extend(remaining)
+    return deal
+
+
+def sample_deal_by_rank(start=0, stop=DEALS_COUNT):
+    """
+    Returns a deal whose rank is uniformly random in [start, stop). By default,
+    that's a uniformly random deal.
+    """
+    return unrank_deal(start + randomness.randbelow(stop - start))
+
+
+def encode_deal_bin12(deal):
+    return rank_deal(deal).to_bytes(BINARY_RECORD_SIZES['bin12'], 'big')
+
+
+def decode_deal_bin12(record):
+    return unrank_deal(int.from_bytes(record, 'big'))
+
+
+def format_deal(deal, fmt):
+    """
+    Returns the deal as bytes, ready to be written to sys.stdout.buffer.
+    `fmt` is 'None', 'int', 'str', or one of BINARY_RECORD_SIZES. See formats.py
+    for faster text formatting, and the PBN and LIN formats.
+    """
+    if fmt == 'int':
+        return (str(deal) + '\n').encode()
+    elif fmt == 'str':
+        return (deal_to_string(deal) + '\n').encode()
+    elif fmt == 'None':
+        return b''
+    elif fmt == 'bin52':
+        return encode_deal_bin52(deal)
+    elif fmt == 'bin13':
+        return encode_deal_bin13(deal)
+    elif fmt == 'bin12':
+        return encode_deal_bin12(deal)
+    else:
+        raise AssertionError(fmt)
+
+
+def open_deals_bin(filename, fmt):
+    """
+    Returns a read-only memoryview over a file written in a binary format, without
+    reading or copying the file. Deal i is at [i * record_size:(i + 1) * record_size],
+    where record_size is BINARY_RECORD_SIZES[fmt]. Use decode_deal_bin52(),
+    decode_deal_bin13() or decode_deal_bin12() on single records, or numpy.frombuffer(...).reshape(-1, record_size)
+    for bulk processing.
+    """
+    record_size = BINARY_RECORD_SIZES[fmt]
+    size = os.path.getsize(filename)
+    if size % record_size != 0:
+        raise ValueError('{} has {} bytes, which is not a multiple of {}'.format(filename, size, record_size))
+    if size == 0:
+        return memoryview(b'')
+    with open(filename, 'rb') as fp:
+        return memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def iter_deals_bin(filename, fmt):
+    """
+    Yields all deals of a file written in a binary format, as lists of 52 cards.
+    """
+    decode = {'bin52': decode_deal_bin52, 'bin13': decode_deal_bin13, 'bin12': decode_deal_bin12}[fmt]
+    record_size = BINARY_RECORD_SIZES[fmt]
+    records = open_deals_bin(filename, fmt)
+    for offset in range(0, len(records), record_size):
+        yield decode(records[offset:offset + record_size])
+
+
+def write_file_atomically(filename, data):
+    """
+    Writes the bytes `data` to `filename`, such that readers see either the old
+    or the new content, but never a partially written file.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_filename = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='_' + os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.unlink(temp_filename)
+        raise
+
+
 def shuffle_inplace(l):
-    # Why is this being deprecated, and how to generate secure shuffles?
-    random.shuffle(l, secrets.SystemRandom().random)
+    randomness.shuffle_inplace(l)
+
+
+def shuffle_prefix_inplace(l, k):
+    randomness.shuffle_prefix_inplace(l, k)
+
 
+# Which seats to deal. A deal that has only some of the seats is shorter: 13
+# cards for North only, 26 cards for North and then South. The samplers then
+# don't spend any time or randomness on the other seats.
+SEATS = ('NESW', 'NS', 'N')
+# seats -> the hands they have, by position in a full deal (0 = North, 1 = East, ...)
+SEAT_HANDS = {'NESW': (0, 1, 2, 3), 'NS': (0, 2), 'N': (0,)}
+
+
+def deal_other_seats(deal, remaining_cards, seats):
+    """
+    Completes `deal` (North's 13 cards) with the requested `seats` from the
+    `remaining_cards` (39 cards, or none if `seats` is 'N'), which are reordered.
+    Returns `deal`.
+    """
+    assert len(deal) == 13
+    if seats == 'NESW':
+        shuffle_inplace(remaining_cards)
+        deal.extend(remaining_cards)
+    elif seats == 'NS':
+        # South is a random selection of 13 of the remaining cards.
+        shuffle_prefix_inplace(remaining_cards, 13)
+        deal.extend(remaining_cards[:13])
+    else:
+        assert seats == 'N', seats
+    return deal
+
+
+def select_seats(deal, seats):
+    """
+    Returns only the `seats` of the full deal `deal`.
+    """
+    assert len(deal) == 52
+    if seats == 'NESW':
+        return deal
+    return [card for hand in SEAT_HANDS[seats] for card in deal[13 * hand:13 * (hand + 1)]]
 
-def sample_deal_4suits(count_4suits):
+
+def sample_deal_4suits(count_4suits, seats='NESW'):
     assert len(count_4suits) == 4
     assert sum(count_4suits) == 13
 
+    if seats != 'NESW':
+        # Only draw North's cards, and (if needed) South's from the rest.
+        deal = []
+        remaining_cards = []
+        for suit_idx, suit_count in enumerate(count_4suits):
+            in_suit = list(range(13 * suit_idx, 13 * (suit_idx + 1)))
+            shuffle_prefix_inplace(in_suit, suit_count)
+            deal.extend(in_suit[:suit_count])
+            if seats != 'N':
+                remaining_cards.extend(in_suit[suit_count:])
+        return deal_other_seats(deal, remaining_cards, seats)
+
     cards_by_suit = []
     for i in range(4):
         in_suit = list(range(13 * i, 13 * (i + 1)))
@@ -111,14 +416,31 @@ def count_hpc(cards):
     return sum(max(0, card_rank(i) - 8) for i in cards)
 
 
+# A set of honors within a single suit is a bitmask: bit 0 is the Jack, bit 1 the
+# Queen, bit 2 the King, and bit 3 the Ace. So the card of bit `i` has rank 9 + i.
+
+def honors_count(honors):
+    assert 0 <= honors < (1 << HONORS_PER_SUIT)
+    return bin(honors).count('1')
+
+
+def honors_hpc(honors):
+    assert 0 <= honors < (1 << HONORS_PER_SUIT)
+    return sum(i + 1 for i in range(HONORS_PER_SUIT) if honors & (1 << i))
+
+
 def last_x_slice(l, x):
+    """
+    Returns the last `x` elements of `l`. `x` may be anything from 0 to len(l):
+    A suit without an upper bound asks for all 13 cards.
+    """
     if x == 0:
         return []
-    assert 0 < x < len(l)
+    assert 0 < x <= len(l)
     return l[-x:]
 
 
-def try_sample_deal_4suits_hpc(count_4suits, min_max_reqs):
+def try_sample_deal_4suits_hpc(count_4suits, min_max_reqs, seats='NESW'):
     assert len(count_4suits) == 4
     assert sum(count_4suits) == 13
     assert len(min_max_reqs) == 10
@@ -126,6 +448,9 @@ def try_sample_deal_4suits_hpc(count_4suits, min_max_reqs):
     tries = 0
     while True:
         tries += 1
+        if metrics.enabled:
+            metrics.increment('monte_carlo_attempts')
+            start = time.perf_counter()
         # `cards_by_suit` is a list of list of cards!
         cards_by_suit = []
         min_hpc = 0
@@ -138,15 +463,19 @@ def try_sample_deal_4suits_hpc(count_4suits, min_max_reqs):
             min_hpc += count_hpc(min_tail)
             max_hpc += count_hpc(max_tail)
             cards_by_suit.append(in_suit)
+        if metrics.enabled:
+            metrics.observe('monte_carlo_shuffle', time.perf_counter() - start)
         # If we already know that this shuffling of ranks is impossible in all
         # cases, independent of the specific count_4suits, then we can retry
         # immediately without screwing up the probabilities.
         if min_hpc > min_max_reqs[-1]:
             # We will definitely overshoot. Retry.
-            pass
+            if metrics.enabled:
+                metrics.increment('monte_carlo_early_reject_overshoot')
         elif max_hpc < min_max_reqs[-2]:
             # We will definitely undershoot. Retry.
-            pass
+            if metrics.enabled:
+                metrics.increment('monte_carlo_early_reject_undershoot')
         else:
             # This *may* be a good deal.
             break
@@ -162,13 +491,12 @@ def try_sample_deal_4suits_hpc(count_4suits, min_max_reqs):
 
     # Then, deal the rest randomly:
     remaining_cards = []
-    for suit_cards in cards_by_suit:
-        remaining_cards.extend(suit_cards)
-    del suit_cards
-    shuffle_inplace(remaining_cards)
-    deal.extend(remaining_cards)
-    assert len(deal) == 52
-    assert set(deal) == set(range(52))
+    if seats != 'N':
+        for suit_cards in cards_by_suit:
+            remaining_cards.extend(suit_cards)
+    deal_other_seats(deal, remaining_cards, seats)
+    assert len(deal) == 13 * len(seats)
+    assert len(set(deal)) == len(deal)
 
     # Did this mess it up?
     actual_hpc = count_hpc(deal[:13])
@@ -176,14 +504,18 @@ def try_sample_deal_4suits_hpc(count_4suits, min_max_reqs):
     if actual_hpc < min_max_reqs[-2] or actual_hpc > min_max_reqs[-1]:
         # Yup, we missed the mark. Cannot retry here, or we would mess up the
         # probability for the current `count_4suits`.
+        if metrics.enabled:
+            metrics.increment('monte_carlo_late_reject_undershoot' if actual_hpc < min_max_reqs[-2] else 'monte_carlo_late_reject_overshoot')
         return None, tries
 
     return deal, tries
 
 
 def tighten_mmr(min_max_reqs):
+    # Superseded by constraints.compile_spec(), which computes the tightest bounds
+    # directly, also for HPC, and raises ValueError instead of never returning
+    # if `min_max_reqs` cannot be satisfied. Only kept for existing callers.
     min_max_reqs = list(min_max_reqs)  # Copy
-    # There's a better way to compute this.
     change = True
     while change:
         change = False
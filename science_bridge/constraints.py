@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+
+import common
+import fractions
+import functools
+import hpc_sampler
+import sys
+import table
+import table_cache
+
+# Compiles constraints on North's hand into their tightest form, and decides up
+# front how to sample them.
+#
+# A spec has:
+# - suit_reqs: 8 integers, min and max length for each suit (as for table_sampler)
+# - hpc_reqs: 2 integers, min and max HPC
+# - honor_reqs: 8 integers, min and max number of honors (J, Q, K, A) in each suit
+# - patterns: None (any), or the allowed patterns, each the 4 suit lengths in
+#   descending order, e.g. (5, 3, 3, 2)
+#
+# Compiling counts the matching hands exactly (by suit lengths, HPC and honors,
+# see hpc_sampler for the idea), so every bound can be tightened to the smallest
+# and largest value that a matching hand actually has. This supersedes
+# common.tighten_mmr(), which only looks at the suit lengths, and never returns
+# if they cannot be satisfied. Here, unsatisfiable specs raise a ValueError, and
+# so do specs that the chosen strategy would need more than MAX_EXPECTED_TRIES
+# tries per deal for.
+
+NO_SUIT_REQS = (0, 13) * 4
+NO_HPC_REQS = (0, 37)
+NO_HONOR_REQS = (0, common.HONORS_PER_SUIT) * 4
+MAX_EXPECTED_TRIES = 10 ** 6
+
+# Strategies, cheapest first. All of them produce exactly the right distribution.
+# - '4suits': Only suit lengths (and patterns) matter, sample from the suit table.
+# - '4suits_hpc': Sample from the (c, d, h, s, hpc) table, see hpc_sampler.
+# - 'honors': Like '4suits_hpc', but reject deals where the honors don't match.
+STRATEGIES = ('4suits', '4suits_hpc', 'honors')
+
+
+@functools.lru_cache(maxsize=None)
+def compute_suit_weights_honors():
+    """
+    Returns a tuple indexed by suit length, each entry a dict mapping (hpc, honors)
+    to the number of holdings in a single suit with that length, hpc and number
+    of honors.
+    """
+    # Neither depends on the suit, so just pick clubs.
+    by_length = table.compute_suit_points_counts(0, (table.evaluate_hpc, table.evaluate_honors))
+    return tuple(dict(by_points) for by_points in by_length)
+
+
+def pattern_of(cdhs_counts):
+    return tuple(sorted(cdhs_counts, reverse=True))
+
+
+def parse_pattern(text):
+    """
+    Parses "5332" or "5-3-3-2" (needed for suits of 10 or more cards) into (5, 3, 3, 2).
+    """
+    parts = text.split('-') if '-' in text else list(text)
+    pattern = pattern_of(int(part) for part in parts)
+    if len(pattern) != 4 or sum(pattern) != 13:
+        raise ValueError('Pattern {!r} does not have 4 suits with 13 cards'.format(text))
+    return pattern
+
+
+def count_in_range(weights, lo, hi):
+    return sum(count for hpc, count in weights.items() if lo <= hpc <= hi)
+
+
+def compile_spec(suit_reqs=NO_SUIT_REQS, hpc_reqs=NO_HPC_REQS, honor_reqs=NO_HONOR_REQS, patterns=None):
+    """
+    Returns the compiled spec as a dict with the entries:
+    - 'suit_reqs', 'hpc_reqs', 'honor_reqs': The tightest equivalent bounds.
+    - 'patterns': The allowed patterns that are actually possible, or None if
+      patterns were not restricted.
+    - 'count': The number of North hands that satisfy the spec.
+    - 'probability': The probability of that, as a Fraction.
+    - 'strategy': The cheapest strategy that samples it exactly, see STRATEGIES.
+    - 'expected_tries': The expected number of tries per deal with that strategy.
+    - 'monte_carlo_tries': The same for the old Monte Carlo sampler, which samples
+      suit lengths exactly and rejects everything else.
+    Raises ValueError if the spec cannot be satisfied, or would need too many tries.
+    The computation is memoized; the result must not be modified.
+    """
+    assert len(suit_reqs) == 8 and len(hpc_reqs) == 2 and len(honor_reqs) == 8
+    if patterns is not None:
+        patterns = frozenset(pattern_of(pattern) for pattern in patterns)
+    compiled = memoized_compile_spec(tuple(suit_reqs), tuple(hpc_reqs), tuple(honor_reqs), patterns)
+    if compiled['count'] == 0:
+        # Only mention what was actually constrained.
+        given = []
+        if tuple(suit_reqs) != NO_SUIT_REQS:
+            given.append('suits {}'.format(tuple(suit_reqs)))
+        if tuple(hpc_reqs) != NO_HPC_REQS:
+            given.append('HPC {}'.format(tuple(hpc_reqs)))
+        if tuple(honor_reqs) != NO_HONOR_REQS:
+            given.append('honors {}'.format(tuple(honor_reqs)))
+        if patterns is not None:
+            given.append('patterns {}'.format(sorted(patterns, reverse=True)))
+        raise ValueError('Constraints cannot be satisfied: {}'.format(', '.join(given)))
+    if compiled['expected_tries'] > MAX_EXPECTED_TRIES:
+        raise ValueError('Constraints are too rare: only 1 in {:.0f} hands with these suit lengths and HPC has these honors'.format(compiled['expected_tries']))
+    return compiled
+
+
+@functools.lru_cache(maxsize=128)
+def memoized_compile_spec(suit_reqs, hpc_reqs, honor_reqs, patterns):
+    if hpc_reqs == NO_HPC_REQS and honor_reqs == NO_HONOR_REQS:
+        # Only the suit lengths matter, which is quick (and the most common case).
+        return compute_compiled_suits(suit_reqs, patterns)
+    # Otherwise compiling can be most of a short run, so it's also cached on disk.
+    cache_key = suit_reqs + hpc_reqs + honor_reqs
+    if patterns is not None:
+        cache_key += (-1,) + tuple(length for pattern in sorted(patterns) for length in pattern)
+    return table_cache.load_or_compute('compiled', cache_key, lambda: compute_compiled_spec(suit_reqs, hpc_reqs, honor_reqs, patterns),
+                                       compiled_to_entries, compiled_from_entries)
+
+
+def compiled_to_entries(compiled):
+    entries = []
+    for name, value in compiled.items():
+        if isinstance(value, fractions.Fraction):
+            value = [value.numerator, value.denominator]
+        elif name == 'patterns' and value is not None:
+            value = [list(pattern) for pattern in value]
+        elif isinstance(value, tuple):
+            value = list(value)
+        entries.append([name, value])
+    return entries
+
+
+def compiled_from_entries(entries):
+    compiled = dict()
+    for name, value in entries:
+        if name == 'probability':
+            value = fractions.Fraction(*value)
+        elif name == 'patterns' and value is not None:
+            value = tuple(tuple(pattern) for pattern in value)
+        elif isinstance(value, list):
+            value = tuple(value)
+        compiled[name] = value
+    return compiled
+
+
+def compute_compiled_suits(suit_reqs, patterns):
+    # Like compute_compiled_spec() without HPC and honor constraints. Then every
+    # holding of each suit is allowed, so only the shapes need to be counted.
+    suit_weights = compute_suit_weights_honors()
+    hpc_ranges = [(min(hpc for hpc, _ in suit_weights[length]), max(hpc for hpc, _ in suit_weights[length])) for length in range(13 + 1)]
+    honor_ranges = [(min(honors for _, honors in suit_weights[length]), max(honors for _, honors in suit_weights[length])) for length in range(13 + 1)]
+    count = 0
+    found_patterns = set()
+    suit_bounds = [[13, 0] for _ in range(4)]
+    hpc_bounds = [37, 0]
+    honor_bounds = [[common.HONORS_PER_SUIT, 0] for _ in range(4)]
+    for cdhs_counts in table.gen_4suits_counts():
+        if not all(suit_reqs[2 * i] <= cdhs_counts[i] <= suit_reqs[2 * i + 1] for i in range(4)):
+            continue
+        if patterns is not None and pattern_of(cdhs_counts) not in patterns:
+            continue
+        count += common.binomial(13, cdhs_counts[0]) * common.binomial(13, cdhs_counts[1]) * common.binomial(13, cdhs_counts[2]) * common.binomial(13, cdhs_counts[3])
+        found_patterns.add(pattern_of(cdhs_counts))
+        hpc_bounds[0] = min(hpc_bounds[0], sum(hpc_ranges[length][0] for length in cdhs_counts))
+        hpc_bounds[1] = max(hpc_bounds[1], sum(hpc_ranges[length][1] for length in cdhs_counts))
+        for suit in range(4):
+            suit_bounds[suit][0] = min(suit_bounds[suit][0], cdhs_counts[suit])
+            suit_bounds[suit][1] = max(suit_bounds[suit][1], cdhs_counts[suit])
+            honor_bounds[suit][0] = min(honor_bounds[suit][0], honor_ranges[cdhs_counts[suit]][0])
+            honor_bounds[suit][1] = max(honor_bounds[suit][1], honor_ranges[cdhs_counts[suit]][1])
+    if count == 0:
+        return {'count': 0, 'expected_tries': None}
+    return {
+        'suit_reqs': tuple(bound for bounds in suit_bounds for bound in bounds),
+        'hpc_reqs': tuple(hpc_bounds),
+        'honor_reqs': tuple(bound for bounds in honor_bounds for bound in bounds),
+        'patterns': None if patterns is None else tuple(sorted(found_patterns, reverse=True)),
+        'count': count,
+        'probability': fractions.Fraction(count, table.HANDS_TOTAL),
+        'strategy': '4suits',
+        'expected_tries': 1,
+        'monte_carlo_tries': 1,
+    }
+
+
+def compute_compiled_spec(suit_reqs, hpc_reqs, honor_reqs, patterns):
+    hpc_min, hpc_max = hpc_reqs
+    suit_weights = compute_suit_weights_honors()
+    # For each suit and length: The weights of the allowed honor counts, by hpc.
+    allowed = [[dict() for _ in range(13 + 1)] for _ in range(4)]
+    for suit in range(4):
+        for length in range(13 + 1):
+            for (hpc, honors), count in suit_weights[length].items():
+                if honor_reqs[2 * suit] <= honors <= honor_reqs[2 * suit + 1]:
+                    allowed[suit][length][hpc] = allowed[suit][length].get(hpc, 0) + count
+
+    # (first suit, lengths of it and the following suits) -> the weights of these
+    # suits together, by hpc. Many shapes share the same first or last two suits,
+    # so most convolutions are only done once per spec.
+    partial_weights = dict()
+
+    def weights_of(first, lengths):
+        key = (first, lengths)
+        if key not in partial_weights:
+            if len(lengths) == 1:
+                partial_weights[key] = allowed[first][lengths[0]]
+            else:
+                half = len(lengths) // 2
+                partial_weights[key] = hpc_sampler.convolve(weights_of(first, lengths[:half]), weights_of(first + half, lengths[half:]))
+        return partial_weights[key]
+
+    def others_of(suit, cdhs_counts):
+        # The other three suits together, by hpc
+        if suit == 0:
+            return weights_of(1, cdhs_counts[1:])
+        if suit == 3:
+            return weights_of(0, cdhs_counts[:3])
+        return hpc_sampler.convolve(weights_of(0, cdhs_counts[:suit]), weights_of(suit + 1, cdhs_counts[suit + 1:]))
+
+    count = 0
+    found_patterns = set()
+    suit_bounds = [[13, 0] for _ in range(4)]
+    hpc_bounds = [37, 0]
+    honor_bounds = [[common.HONORS_PER_SUIT, 0] for _ in range(4)]
+    for cdhs_counts in table.gen_4suits_counts():
+        if not all(suit_reqs[2 * i] <= cdhs_counts[i] <= suit_reqs[2 * i + 1] for i in range(4)):
+            continue
+        if patterns is not None and pattern_of(cdhs_counts) not in patterns:
+            continue
+        combined = weights_of(0, cdhs_counts)
+        shape_count = count_in_range(combined, hpc_min, hpc_max)
+        if shape_count == 0:
+            continue
+        for hpc, hpc_count in combined.items():
+            if hpc_min <= hpc <= hpc_max and hpc_count > 0:
+                hpc_bounds[0] = min(hpc_bounds[0], hpc)
+                hpc_bounds[1] = max(hpc_bounds[1], hpc)
+        for suit in range(4):
+            if honor_bounds[suit] == [honor_reqs[2 * suit], honor_reqs[2 * suit + 1]]:
+                # Can't get any wider.
+                continue
+            others = others_of(suit, cdhs_counts)
+            # Which honor counts of this suit can be completed by the other suits?
+            for (hpc, honors), holdings in suit_weights[cdhs_counts[suit]].items():
+                if honor_reqs[2 * suit] <= honors <= honor_reqs[2 * suit + 1] and count_in_range(others, hpc_min - hpc, hpc_max - hpc) > 0:
+                    honor_bounds[suit][0] = min(honor_bounds[suit][0], honors)
+                    honor_bounds[suit][1] = max(honor_bounds[suit][1], honors)
+        count += shape_count
+        found_patterns.add(pattern_of(cdhs_counts))
+        for suit in range(4):
+            suit_bounds[suit][0] = min(suit_bounds[suit][0], cdhs_counts[suit])
+            suit_bounds[suit][1] = max(suit_bounds[suit][1], cdhs_counts[suit])
+
+    if count == 0:
+        return {'count': 0, 'expected_tries': None}
+    compiled = {
+        'suit_reqs': tuple(bound for bounds in suit_bounds for bound in bounds),
+        'hpc_reqs': tuple(hpc_bounds),
+        'honor_reqs': tuple(bound for bounds in honor_bounds for bound in bounds),
+        'patterns': None if patterns is None else tuple(sorted(found_patterns, reverse=True)),
+        'count': count,
+        'probability': fractions.Fraction(count, table.HANDS_TOTAL),
+    }
+    # The hands that the strategies sample from, before rejecting anything. These
+    # use the tightened bounds, so they may be much closer to `count`.
+    count_shapes = 0  # Suit lengths (and patterns) satisfied
+    count_shapes_hpc = 0  # Also the HPC
+    for cdhs_counts in filter_table_compiled(table.count_table_4suits(), compiled):
+        count_shapes += common.binomial(13, cdhs_counts[0]) * common.binomial(13, cdhs_counts[1]) * common.binomial(13, cdhs_counts[2]) * common.binomial(13, cdhs_counts[3])
+        count_shapes_hpc += count_in_range(hpc_sampler.compute_suffix_weights(cdhs_counts), hpc_bounds[0], hpc_bounds[1])
+    if count == count_shapes:
+        strategy = '4suits'
+        expected_tries = 1
+    elif count == count_shapes_hpc:
+        strategy = '4suits_hpc'
+        expected_tries = 1
+    else:
+        strategy = 'honors'
+        expected_tries = count_shapes_hpc / count
+    compiled['strategy'] = strategy
+    compiled['expected_tries'] = expected_tries
+    compiled['monte_carlo_tries'] = count_shapes / count
+    return compiled
+
+
+def matches(compiled, cards):
+    """
+    Whether the 13 `cards` satisfy the compiled spec.
+    """
+    lengths = [0] * 4
+    honors = [0] * 4
+    for card in cards:
+        lengths[common.card_suit(card)] += 1
+        honors[common.card_suit(card)] += common.card_rank(card) >= 9
+    suit_reqs = compiled['suit_reqs']
+    hpc_reqs = compiled['hpc_reqs']
+    honor_reqs = compiled['honor_reqs']
+    return (all(suit_reqs[2 * i] <= lengths[i] <= suit_reqs[2 * i + 1] and honor_reqs[2 * i] <= honors[i] <= honor_reqs[2 * i + 1] for i in range(4))
+            and hpc_reqs[0] <= common.count_hpc(cards) <= hpc_reqs[1]
+            and (compiled['patterns'] is None or pattern_of(lengths) in compiled['patterns']))
+
+
+def filter_table_compiled(table_int, compiled):
+    """
+    Returns a *new* integer table, keyed by (c, d, h, s) or (c, d, h, s, hpc), with
+    only the suit lengths (and HPC) that the compiled spec allows. The honors are
+    not checked.
+    """
+    suit_reqs = compiled['suit_reqs']
+    hpc_reqs = compiled['hpc_reqs']
+    patterns = compiled['patterns']
+    return {
+        key: count for key, count in table_int.items()
+        if all(suit_reqs[2 * i] <= key[i] <= suit_reqs[2 * i + 1] for i in range(4))
+        and (len(key) == 4 or hpc_reqs[0] <= key[4] <= hpc_reqs[1])
+        and (patterns is None or pattern_of(key[:4]) in patterns)
+    }
+
+
+def run_sanity_checks():
+    print('Running sanity checks ...', file=sys.stderr)
+    # Nothing constrained
+    compiled = compile_spec()
+    assert compiled['count'] == table.HANDS_TOTAL
+    assert compiled['suit_reqs'] == NO_SUIT_REQS and compiled['hpc_reqs'] == NO_HPC_REQS and compiled['honor_reqs'] == NO_HONOR_REQS
+    assert compiled['strategy'] == '4suits' and compiled['expected_tries'] == 1
+    # Agrees with common.tighten_mmr() and the suit table whenever that terminates.
+    for suit_reqs in [(1, 3, 3, 5, 3, 7, 3, 6), (0, 2, 3, 4, 3, 5, 3, 5), (0, 0, 0, 0, 0, 13, 0, 13), (4, 4, 3, 3, 3, 3, 3, 3)]:
+        compiled = compile_spec(suit_reqs)
+        assert compiled['suit_reqs'] == common.tighten_mmr(suit_reqs), suit_reqs
+        assert compiled['count'] == sum(table.compute_table_4suits_int(suit_reqs).values())
+    # Agrees with the HPC table, and tightens HPC by the suit lengths: With at
+    # most one card in each minor, they hold at most 8 HPC (two aces).
+    for min_max_reqs in [(0, 2, 3, 4, 3, 5, 3, 5, 26, 30), (0, 13, 0, 13, 0, 13, 5, 13, 15, 17), (0, 1, 0, 1, 0, 13, 0, 13, 0, 37)]:
+        compiled = compile_spec(min_max_reqs[:8], min_max_reqs[8:])
+        hpc_table = hpc_sampler.compute_table_4suits_hpc(min_max_reqs)
+        assert compiled['count'] == sum(hpc_table.values())
+        hpcs = [key[4] for key, count in hpc_table.items() if count > 0]
+        assert compiled['hpc_reqs'] == (min(hpcs), max(hpcs))
+    assert compile_spec((0, 0, 0, 0, 0, 13, 0, 13))['hpc_reqs'] == (0, 20)
+    # Honors: Brute force over all honor sets, in a single suit.
+    compiled = compile_spec((5, 5, 0, 13, 0, 13, 0, 13), (0, 37), (2, 3) + (0, 4) * 3)
+    expected = sum(common.binomial(4, k) * common.binomial(9, 5 - k) for k in (2, 3)) * common.binomial(39, 8)
+    assert compiled['count'] == expected and compiled['strategy'] == 'honors'
+    # HPC are at least 3 (QJ of clubs), and at most 34 (AKQ of clubs, and AAAKKKQQ
+    # in the other suits). Sampling within these only needs to reject some of the
+    # hands with 0-1 or 4 honors in clubs.
+    assert compiled['hpc_reqs'] == (3, 34)
+    assert 1 < compiled['expected_tries'] < common.binomial(13, 5) / sum(common.binomial(4, k) * common.binomial(9, 5 - k) for k in (2, 3))
+    # Without honors, there are no HPC either, so no need to reject anything.
+    assert compile_spec(hpc_reqs=(0, 3), honor_reqs=(0, 0) * 4)['strategy'] == '4suits_hpc'
+    # A void has no honors, 37 HPC are all aces, kings and queens, and one jack.
+    assert compile_spec((0, 0) + (0, 13) * 3)['honor_reqs'][:2] == (0, 0)
+    assert compile_spec(hpc_reqs=(37, 37))['honor_reqs'] == (3, 4) * 4
+    assert compile_spec(hpc_reqs=(37, 37))['strategy'] == '4suits_hpc'
+    # Patterns
+    compiled = compile_spec(patterns=[(4, 3, 3, 3), (3, 4, 3, 3)])
+    assert compiled['patterns'] == ((4, 3, 3, 3),)
+    assert compiled['count'] == 4 * common.binomial(13, 4) * common.binomial(13, 3) ** 3
+    assert compile_spec((5, 13) + (0, 13) * 3, patterns=[parse_pattern('5332'), parse_pattern('7-3-2-1')])['suit_reqs'] == (5, 7, 1, 3, 1, 3, 1, 3)
+    # Unsatisfiable constraints fail fast.
+    for kwargs in [dict(suit_reqs=(0, 2) * 4), dict(hpc_reqs=(38, 40)), dict(suit_reqs=(0, 0, 0, 0, 0, 13, 0, 13), hpc_reqs=(21, 37)),
+                   dict(honor_reqs=(0, 0) * 4, hpc_reqs=(1, 37)), dict(suit_reqs=(4, 13) + (0, 13) * 3, patterns=[(4, 3, 3, 3)], honor_reqs=(0, 4) + (0, 0) * 3, hpc_reqs=(11, 37))]:
+        try:
+            compile_spec(**kwargs)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(kwargs)
+    # The error only mentions what was given.
+    try:
+        compile_spec((0, 2) * 4)
+    except ValueError as e:
+        assert str(e) == 'Constraints cannot be satisfied: suits (0, 2, 0, 2, 0, 2, 0, 2)', e
+    print('  Done', file=sys.stderr)
+
+
+def print_usage():
+    print('USAGE: {} <MIN_MAX_REQS> [--honors <HONOR_REQS>] [--patterns <PATTERN> ...]'.format(sys.argv[0]), file=sys.stderr)
+    print('MIN_MAX_REQS is 10 integers, as for combined_sampler.py.', file=sys.stderr)
+    print('HONOR_REQS is 8 integers, min and max number of honors (J, Q, K, A) for each suit.', file=sys.stderr)
+    print('Each PATTERN is an allowed pattern like "5332", or "7-3-2-1".', file=sys.stderr)
+    print('Prints the tightest equivalent constraints, their probability, and how to sample them.', file=sys.stderr)
+    print('Without arguments, runs the sanity checks.', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args:
+        run_sanity_checks()
+        exit(0)
+    try:
+        min_max_reqs = tuple(int(x) for x in args[:10])
+        honor_reqs = NO_HONOR_REQS
+        patterns = None
+        args = args[10:]
+        while args:
+            if args[0] == '--honors' and len(args) >= 9:
+                honor_reqs = tuple(int(x) for x in args[1:9])
+                args = args[9:]
+            elif args[0] == '--patterns' and len(args) >= 2:
+                patterns = []
+                args = args[1:]
+                while args and not args[0].startswith('--'):
+                    patterns.append(parse_pattern(args[0]))
+                    args = args[1:]
+            else:
+                raise ValueError('Cannot parse {}'.format(args))
+        if len(min_max_reqs) != 10:
+            raise ValueError('Need 10 integers')
+    except ValueError as e:
+        print('{}'.format(e), file=sys.stderr)
+        print_usage()
+        exit(1)
+    try:
+        compiled = compile_spec(min_max_reqs[:8], min_max_reqs[8:], honor_reqs, patterns)
+    except ValueError as e:
+        print('{}'.format(e), file=sys.stderr)
+        exit(1)
+    print('Suit lengths: {}'.format(compiled['suit_reqs']))
+    print('HPC: {}'.format(compiled['hpc_reqs']))
+    print('Honors: {}'.format(compiled['honor_reqs']))
+    if compiled['patterns'] is not None:
+        print('Patterns: {}'.format(', '.join('-'.join(str(length) for length in pattern) for pattern in compiled['patterns'])))
+    print('Probability: {} = {:.3e} (1 in {:.1f})'.format(compiled['probability'], float(compiled['probability']), float(1 / compiled['probability'])))
+    print('Strategy: {}, {:.1f} tries per deal (Monte Carlo: {:.1f})'.format(compiled['strategy'], compiled['expected_tries'], compiled['monte_carlo_tries']))
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+import array
+import bisect
+import common
+import deal_stream
+import formats
+import json
+import mmap
+import os
+import parallel
+import randomness
+import sys
+
+# A "library" is a directory with a large pool of uniformly random deals, plus
+# indexes by North's suit lengths and HPC. Asking for deals with rare
+# constraints then only needs to look up the matching deals, and pick some of
+# them uniformly at random, instead of sampling them from scratch.
+#
+# Files in the directory:
+# - deals.bin13: The deals, in the 'bin13' format (see common.py).
+# - keys.bin: For each deal, KEY_SIZE bytes: North's (c, d, h, s, hpc).
+# - postings_<START>_<END>.bin: One segment of the index: The numbers of the
+#   deals START to END - 1, as native unsigned 32-bit integers, grouped by key.
+# - index.json: How many deals are indexed, and for each segment, for each key
+#   where its group starts in the segment's postings, and how many deals it has.
+# Adding deals only computes the keys of the new deals, and writes a new segment
+# for them. Queries look at all segments. To keep their number small, newer
+# segments are merged into one whenever they are as large as the one before,
+# see update_index().
+
+FORMAT = 'str'  # 'None' or 'int' or 'str' or 'pbn' or 'lin' or 'compact' or 'bin52' or 'bin13' or 'bin12', see formats.py
+
+DEFAULT_NUM_SAMPLES = 10
+INDEX_VERSION = 2
+KEY_SIZE = 5
+POSTINGS_TYPECODE = 'I'
+DEALS_FILENAME = 'deals.bin13'
+KEYS_FILENAME = 'keys.bin'
+INDEX_FILENAME = 'index.json'
+
+
+def compute_key(hands):
+    # `hands` as returned by common.decode_hands_bin13()
+    key = [0, 0, 0, 0, 0]
+    for card, hand in enumerate(hands):
+        if hand == 0:
+            key[common.card_suit(card)] += 1
+            key[4] += max(0, common.card_rank(card) - 8)
+    return bytes(key)
+
+
+def generate(directory, n, workers=1, ordered=False):
+    """
+    Appends `n` uniformly random deals to the library in `directory` (creating it
+    if necessary), and updates the index.
+    """
+    os.makedirs(directory, exist_ok=True)
+    sampler = deal_stream.prepare((0, 13) * 4)
+    with open(os.path.join(directory, DEALS_FILENAME), 'ab') as fp:
+        deal_stream.print_samples(sampler, n, 'bin13', workers, ordered, out=fp)
+    update_index(directory)
+
+
+def segment_filename(start, end):
+    return 'postings_{}_{}.bin'.format(start, end)
+
+
+def write_segment(directory, start, end, groups):
+    """
+    Writes the postings of the deals [start, end) to their own file, where
+    `groups` maps each key to the numbers of its deals. Returns the segment for
+    index.json.
+    """
+    postings = array.array(POSTINGS_TYPECODE)
+    index_groups = []
+    for key in sorted(groups.keys()):
+        index_groups.append(list(key) + [len(postings), len(groups[key])])
+        postings.extend(groups[key])
+    filename = segment_filename(start, end)
+    common.write_file_atomically(os.path.join(directory, filename), postings.tobytes())
+    return {'filename': filename, 'start': start, 'end': end, 'groups': index_groups}
+
+
+def open_postings(directory, segment):
+    filename = os.path.join(directory, segment['filename'])
+    if os.path.getsize(filename) == 0:
+        return memoryview(b'').cast(POSTINGS_TYPECODE)
+    with open(filename, 'rb') as fp:
+        return memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)).cast(POSTINGS_TYPECODE)
+
+
+def merge_segments(directory, segments):
+    """
+    Merges the consecutive `segments` into one, and returns it.
+    """
+    groups = dict()
+    for segment in segments:
+        postings = open_postings(directory, segment)
+        for group in segment['groups']:
+            key, start, size = bytes(group[:KEY_SIZE]), group[KEY_SIZE], group[KEY_SIZE + 1]
+            groups.setdefault(key, []).extend(postings[start:start + size])
+        postings.release()
+    return write_segment(directory, segments[0]['start'], segments[-1]['end'], groups)
+
+
+def read_index(directory):
+    with open(os.path.join(directory, INDEX_FILENAME), 'rb') as fp:
+        return json.load(fp)
+
+
+def update_index(directory):
+    """
+    Computes the keys of all deals that aren't indexed yet, and adds them to the
+    index. Returns the number of indexed deals.
+    """
+    deals_filename = os.path.join(directory, DEALS_FILENAME)
+    keys_filename = os.path.join(directory, KEYS_FILENAME)
+    record_size = common.BINARY_RECORD_SIZES['bin13']
+    records = common.open_deals_bin(deals_filename, 'bin13')
+    num_deals = len(records) // record_size
+    if num_deals >= 1 << (8 * array.array(POSTINGS_TYPECODE).itemsize):
+        raise ValueError('Too many deals for the index')
+
+    segments = []
+    num_indexed = 0
+    if os.path.exists(os.path.join(directory, INDEX_FILENAME)):
+        index = read_index(directory)
+        # An index of an older version is rebuilt from keys.bin.
+        if index['version'] == INDEX_VERSION:
+            segments = index['segments']
+            num_indexed = index['num_deals']
+    if num_indexed > num_deals:
+        raise ValueError('{} has more deals indexed than {} has deals'.format(INDEX_FILENAME, deals_filename))
+
+    with open(keys_filename, 'ab+') as fp:
+        # An interrupted run may have left a partial key behind.
+        num_keyed = fp.tell() // KEY_SIZE
+        fp.truncate(num_keyed * KEY_SIZE)
+        fp.seek(num_keyed * KEY_SIZE)
+        if num_keyed > num_deals:
+            raise ValueError('{} has more keys than {} has deals'.format(keys_filename, deals_filename))
+        for deal_idx in range(num_keyed, num_deals):
+            offset = deal_idx * record_size
+            fp.write(compute_key(common.decode_hands_bin13(records[offset:offset + record_size])))
+        fp.flush()
+        fp.seek(num_indexed * KEY_SIZE)
+        new_keys = fp.read()
+
+    if num_deals > num_indexed:
+        groups = dict()
+        for deal_idx in range(num_indexed, num_deals):
+            offset = (deal_idx - num_indexed) * KEY_SIZE
+            groups.setdefault(new_keys[offset:offset + KEY_SIZE], []).append(deal_idx)
+        segments.append(write_segment(directory, num_indexed, num_deals, groups))
+    # Like a binary counter: Merge the newest segments as long as the one before
+    # isn't larger. So there are only O(log(num_deals)) segments, and each deal
+    # is only rewritten O(log(num_deals)) times in total.
+    while len(segments) >= 2 and segments[-2]['end'] - segments[-2]['start'] <= segments[-1]['end'] - segments[-1]['start']:
+        segments[-2:] = [merge_segments(directory, segments[-2:])]
+
+    # The segments are written first, so that the index never refers to missing postings.
+    index = {
+        'version': INDEX_VERSION,
+        'num_deals': num_deals,
+        'segments': segments,
+    }
+    common.write_file_atomically(os.path.join(directory, INDEX_FILENAME), json.dumps(index, separators=(',', ':')).encode())
+    # Remove the postings that were merged (or are left over from an older version).
+    in_use = {segment['filename'] for segment in segments}
+    for filename in os.listdir(directory):
+        if (filename.startswith('postings') and filename.endswith('.bin')) and filename not in in_use:
+            os.unlink(os.path.join(directory, filename))
+    return num_deals
+
+
+def open_library(directory):
+    """
+    Returns a tuple (index, postings, records), where `postings` is a list of
+    memoryviews over the memory-mapped postings of each segment, and `records`
+    one over the deals.
+    """
+    index = read_index(directory)
+    if index['version'] != INDEX_VERSION:
+        raise ValueError('{} has version {}, expected {} (run "index" to rebuild it)'.format(INDEX_FILENAME, index['version'], INDEX_VERSION))
+    postings = [open_postings(directory, segment) for segment in index['segments']]
+    records = common.open_deals_bin(os.path.join(directory, DEALS_FILENAME), 'bin13')
+    return index, postings, records
+
+
+def sample_distinct(n, k):
+    """
+    Returns `k` distinct integers from [0, n), uniformly at random and in random order.
+    """
+    assert 0 <= k <= n
+    # Robert Floyd's algorithm: Only needs k random numbers, no matter how large n is.
+    chosen = set()
+    for upper in range(n - k, n):
+        candidate = randomness.randbelow(upper + 1)
+        chosen.add(upper if candidate in chosen else candidate)
+    chosen = list(chosen)
+    common.shuffle_inplace(chosen)
+    return chosen
+
+
+def query(directory, min_max_reqs, count):
+    """
+    Returns a tuple (deals, num_matching): Up to `count` deals (a uniformly random
+    selection, without repetition) from the library in `directory` where North
+    satisfies `min_max_reqs` (10 integers, as for combined_sampler), and the total
+    number of matching deals in the library.
+    """
+    assert len(min_max_reqs) == 10
+    index, postings, records = open_library(directory)
+    # For each matching group: its postings, and where it starts in them
+    starts = []
+    cumulative = []
+    num_matching = 0
+    for segment, segment_postings in zip(index['segments'], postings):
+        for group in segment['groups']:
+            key, start, size = group[:KEY_SIZE], group[KEY_SIZE], group[KEY_SIZE + 1]
+            if all(min_max_reqs[2 * i] <= key[i] <= min_max_reqs[2 * i + 1] for i in range(KEY_SIZE)):
+                starts.append((segment_postings, start))
+                num_matching += size
+                cumulative.append(num_matching)
+    record_size = common.BINARY_RECORD_SIZES['bin13']
+    deals = []
+    for chosen in sample_distinct(num_matching, min(count, num_matching)):
+        group_idx = bisect.bisect_right(cumulative, chosen)
+        offset_in_group = chosen - (cumulative[group_idx - 1] if group_idx > 0 else 0)
+        group_postings, start = starts[group_idx]
+        deal_idx = group_postings[start + offset_in_group]
+        deals.append(common.decode_deal_bin13(records[deal_idx * record_size:(deal_idx + 1) * record_size]))
+    return deals, num_matching
+
+
+def print_usage():
+    print('USAGE: {} [OPTIONS] generate <DIRECTORY> <NUM_DEALS>'.format(sys.argv[0]), file=sys.stderr)
+    print('   or: {} index <DIRECTORY>'.format(sys.argv[0]), file=sys.stderr)
+    print('   or: {} [OPTIONS] query <DIRECTORY> <MIN_MAX_REQS> [<NUM_SAMPLES>]'.format(sys.argv[0]), file=sys.stderr)
+    print('"generate" adds NUM_DEALS uniformly random deals to the library, and updates the index.', file=sys.stderr)
+    print('"index" updates the index, e.g. after an interrupted "generate".', file=sys.stderr)
+    print('"query" prints NUM_SAMPLES (default {}) deals from the library where North'.format(DEFAULT_NUM_SAMPLES), file=sys.stderr)
+    print('satisfies MIN_MAX_REQS (10 integers, as for combined_sampler.py).', file=sys.stderr)
+    parallel.print_options_usage()
+
+
+if __name__ == '__main__':
+    try:
+        args, workers, ordered, seed = parallel.split_options(sys.argv[1:])
+    except ValueError as e:
+        # Falls through to the usage below.
+        print(e, file=sys.stderr)
+        args, workers, ordered, seed = [], 1, False, None
+    if seed is not None:
+        randomness.seed(seed)
+    if len(args) == 3 and args[0] == 'generate':
+        generate(args[1], int(args[2]), workers=workers, ordered=ordered)
+    elif len(args) == 2 and args[0] == 'index':
+        print('Indexed {} deals'.format(update_index(args[1])), file=sys.stderr)
+    elif len(args) in (2 + 10, 2 + 10 + 1) and args[0] == 'query':
+        num_samples = int(args[12]) if len(args) == 13 else DEFAULT_NUM_SAMPLES
+        deals, num_matching = query(args[1], tuple(int(x) for x in args[2:12]), num_samples)
+        print('{} matching deals in the library'.format(num_matching), file=sys.stderr)
+        if len(deals) < num_samples:
+            print('WARNING: Only {} matching deals, printing all of them'.format(len(deals)), file=sys.stderr)
+        sys.stdout.buffer.write(formats.format_deals(deals, FORMAT))
+        sys.stdout.buffer.flush()
+    else:
+        print_usage()
+        exit(1)
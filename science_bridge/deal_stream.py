@@ -0,0 +1,292 @@
+#!/bin/false
+
+import common
+import constraints
+import formats
+import hands_sampler
+import hpc_sampler
+import metrics
+import parallel
+import sys
+import table
+import table_cache
+import time
+
+# Library interface to the samplers, for use without going through stdout:
+#
+#     import deal_stream
+#     for deals in deal_stream.iter_deals((0, 2, 3, 4, 3, 5, 3, 5, 26, 30), count=10000):
+#         ...  # `deals` is a list of up to 1000 deals, each a list of 52 cards
+#
+# With metadata=True, each batch comes as (deals, metadata) instead. See
+# iter_deals() for details. With seats='N' (or 'NS'), each deal only has North's
+# 13 cards (or North's and then South's 26), and the other seats are never dealt,
+# see common.SEATS. The CLIs table_sampler and combined_sampler are thin
+# wrappers around this module.
+
+DEFAULT_BATCH_SIZE = 1000
+# The stratified method deals each shape at once, so the larger the batch, the
+# less overhead per deal.
+STRATIFIED_BATCH_SIZE = 100000
+REPORT_FRACTION = 10000
+
+# 'exact' never rejects anything. 'monte-carlo' is the old rejection sampler,
+# kept around as an independent reference for statistical cross-checks.
+# 'stratified' is like 'exact', but deals each batch shape by shape with numpy
+# (see batch_sampler.sample_stratified_4suits()); only for suit constraints.
+METHODS = ('exact', 'monte-carlo', 'stratified')
+
+# tighten() results. The CLIs tighten min_max_reqs (to report that), and then
+# prepare() tightens them again; with these, the spec is only compiled once.
+TIGHTENED_CACHE_SIZE = 128
+tightened_reqs = dict()
+
+
+def tighten(min_max_reqs):
+    """
+    Returns the tightened version of `min_max_reqs` (8 integers for suits only, or
+    10 integers for suits and HPC). See constraints.compile_spec(), which also
+    raises ValueError if they cannot be satisfied.
+    """
+    assert len(min_max_reqs) in (8, 10), min_max_reqs
+    min_max_reqs = tuple(min_max_reqs)
+    if min_max_reqs not in tightened_reqs:
+        compiled = constraints.compile_spec(min_max_reqs[:8], min_max_reqs[8:] or constraints.NO_HPC_REQS)
+        tightened = compiled['suit_reqs'] + (compiled['hpc_reqs'] if len(min_max_reqs) == 10 else ())
+        if len(tightened_reqs) >= TIGHTENED_CACHE_SIZE:
+            tightened_reqs.clear()
+        # Tightening again doesn't change anything, so remember that too.
+        tightened_reqs[min_max_reqs] = tightened_reqs[tightened] = tightened
+    return tightened_reqs[min_max_reqs]
+
+
+def prepare(min_max_reqs, method='exact', seats='NESW'):
+    """
+    Builds everything needed to sample deals with `min_max_reqs` (8 integers for
+    suits only, or 10 integers for suits and HPC), with only the given `seats`
+    (see common.SEATS). The result can be passed to sample_batch() and
+    iter_deals() any number of times, and is cheap to pickle.
+    """
+    assert method in METHODS, method
+    assert seats in common.SEATS, seats
+    assert method != 'stratified' or len(min_max_reqs) == 8, 'The stratified method only supports suit constraints'
+    min_max_reqs = tighten(min_max_reqs)
+    if len(min_max_reqs) == 10 and method == 'exact':
+        table_int = table_cache.load_or_compute('4suits_hpc', min_max_reqs, lambda: hpc_sampler.compute_table_4suits_hpc(min_max_reqs))
+        kind = '4suits_hpc'
+    else:
+        suit_reqs = min_max_reqs[:8]
+        table_int = table_cache.load_or_compute('4suits', suit_reqs, lambda: table.compute_table_4suits_int(suit_reqs))
+        if len(min_max_reqs) == 10:
+            kind = 'monte-carlo'
+        elif method == 'stratified':
+            kind = '4suits_stratified'
+        else:
+            kind = '4suits'
+    return (kind, table.prepare_table_int(table_int), min_max_reqs, seats)
+
+
+def prepare_spec(suit_reqs=constraints.NO_SUIT_REQS, hpc_reqs=constraints.NO_HPC_REQS, honor_reqs=constraints.NO_HONOR_REQS, patterns=None, seats='NESW'):
+    """
+    Like prepare(), but for the richer constraints of constraints.compile_spec(),
+    using the cheapest strategy it picks. Raises ValueError if they cannot be
+    satisfied, or are too rare.
+    """
+    assert seats in common.SEATS, seats
+    compiled = constraints.compile_spec(suit_reqs, hpc_reqs, honor_reqs, patterns)
+    min_max_reqs = compiled['suit_reqs'] + compiled['hpc_reqs']
+    if compiled['strategy'] == '4suits':
+        suit_reqs = compiled['suit_reqs']
+        table_int = table_cache.load_or_compute('4suits', suit_reqs, lambda: table.compute_table_4suits_int(suit_reqs))
+    else:
+        table_int = table_cache.load_or_compute('4suits_hpc', min_max_reqs, lambda: hpc_sampler.compute_table_4suits_hpc(min_max_reqs))
+    prepared = table.prepare_table_int(constraints.filter_table_compiled(table_int, compiled))
+    if compiled['strategy'] == 'honors':
+        return ('honors', (prepared, compiled), min_max_reqs, seats)
+    return (compiled['strategy'], prepared, min_max_reqs, seats)
+
+
+def prepare_hands(min_max_reqs_per_hand, seats='NESW'):
+    """
+    Like prepare(), but with constraints for all four hands: `min_max_reqs_per_hand`
+    has 4 entries (North, East, South, West), each either None (no restriction)
+    or 8 integers. Raises ValueError if they cannot be satisfied. The hands that
+    are not in `seats` are still constrained, just not dealt.
+    """
+    assert seats in common.SEATS, seats
+    min_max_reqs_per_hand = tuple(None if reqs is None else tuple(reqs) for reqs in min_max_reqs_per_hand)
+    return ('hands', hands_sampler.prepare_hands(min_max_reqs_per_hand), min_max_reqs_per_hand, seats)
+
+
+# For each kind of sampler that never rejects: How to sample a key from the
+# prepared data, and how to deal a deal (with the given seats) for that key.
+EXACT_KINDS = {
+    '4suits': (table.sample_prepared_int, common.sample_deal_4suits),
+    '4suits_hpc': (table.sample_prepared_int, hpc_sampler.sample_deal_4suits_hpc),
+    'hands': (hands_sampler.sample_shapes, hands_sampler.sample_deal_hands),
+}
+
+
+def sample_batch(sampler, size, max_tries=None):
+    """
+    Returns a tuple (deals, keys, tries): `size` deals, for each deal the key that
+    was sampled from the table, i.e. (c, d, h, s) or (c, d, h, s, hpc) for
+    North, or the suit lengths of all hands (see hands_sampler.sample_shapes()),
+    and the total number of tries it took.
+    The samplers that reject ('honors' and 'monte-carlo') stop early once they
+    needed `max_tries` tries, and then return fewer deals (maybe none).
+    """
+    kind, prepared, min_max_reqs, seats = sampler
+    deals = []
+    keys = []
+    tries_total = 0
+    if kind in EXACT_KINDS:
+        sample_key, deal_from_key = EXACT_KINDS[kind]
+        for _ in range(size):
+            if metrics.enabled:
+                start = time.perf_counter()
+            key = sample_key(prepared)
+            if metrics.enabled:
+                sampled = time.perf_counter()
+                metrics.observe('sample_shape', sampled - start)
+            deals.append(deal_from_key(key, seats))
+            if metrics.enabled:
+                metrics.observe('deal', time.perf_counter() - sampled)
+            keys.append(key)
+        tries_total = size
+    elif kind == '4suits_stratified':
+        # Only needs numpy if actually used.
+        import batch_sampler
+        if metrics.enabled:
+            start = time.perf_counter()
+        deal_array, key_indices = batch_sampler.sample_stratified_4suits(prepared, size, batch_sampler.RandomnessGenerator(), seats)
+        deals = deal_array.tolist()
+        keys = [prepared[0][key_idx] for key_idx in key_indices.tolist()]
+        if metrics.enabled:
+            metrics.observe('deal_batch', time.perf_counter() - start)
+        tries_total = size
+    elif kind == 'honors':
+        prepared, compiled = prepared
+        while len(deals) < size and (max_tries is None or tries_total < max_tries):
+            key = table.sample_prepared_int(prepared)
+            deal = hpc_sampler.sample_deal_4suits_hpc(key, seats)
+            tries_total += 1
+            if constraints.matches(compiled, deal[:13]):
+                deals.append(deal)
+                keys.append(key)
+    elif kind == 'monte-carlo':
+        while len(deals) < size and (max_tries is None or tries_total < max_tries):
+            if metrics.enabled:
+                start = time.perf_counter()
+            key = table.sample_prepared_int(prepared)
+            if metrics.enabled:
+                metrics.observe('sample_shape', time.perf_counter() - start)
+                metrics.increment_keyed('monte_carlo_shape_attempts', key)
+            deal, tries = common.try_sample_deal_4suits_hpc(key, min_max_reqs, seats)
+            tries_total += tries
+            if deal is None:
+                continue
+            if metrics.enabled:
+                metrics.increment_keyed('monte_carlo_shape_accepts', key)
+            deals.append(deal)
+            keys.append(key + (common.count_hpc(deal[:13]),))
+    else:
+        raise AssertionError(kind)
+    return deals, keys, tries_total
+
+
+def iter_deals(constraints, count=None, batch_size=DEFAULT_BATCH_SIZE, metadata=False, method='exact', seats='NESW'):
+    """
+    Lazily yields batches of deals, `count` deals in total (or forever, if None).
+    `constraints` is either `min_max_reqs` (see prepare(), also for `method` and
+    `seats`), or the result of prepare() or prepare_hands().
+    Each batch is a list of deals. If `metadata` is true, each batch is a tuple
+    (deals, metadata) instead, where metadata is a dict with the entries 'keys'
+    (see sample_batch()) and 'tries'.
+    """
+    sampler = constraints if isinstance(constraints[0], str) else prepare(constraints, method, seats)
+    remaining = count
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        deals, keys, tries = sample_batch(sampler, size)
+        if metadata:
+            yield deals, {'keys': keys, 'tries': tries}
+        else:
+            yield deals
+        if remaining is not None:
+            remaining -= size
+
+
+async def aiter_deals(constraints, count=None, batch_size=DEFAULT_BATCH_SIZE, metadata=False, method='exact', seats='NESW'):
+    """
+    Like iter_deals(), but as an async generator. Each batch is only computed
+    when the consumer asks for it (so a slow consumer automatically slows down
+    sampling), and in a thread, so the event loop stays responsive.
+    Several of these running at once share the random source (see randomness.py),
+    so with a seed, which deals each one gets depends on the timing.
+    """
+    # Only imported here, as it takes longer than many short runs of the CLIs.
+    import asyncio
+    loop = asyncio.get_running_loop()
+    batches = iter_deals(constraints, count, batch_size, metadata, method, seats)
+    done = object()
+    while True:
+        batch = await loop.run_in_executor(None, next, batches, done)
+        if batch is done:
+            return
+        yield batch
+
+
+# == Helpers for the CLIs ==
+
+def format_chunk(sampler_and_fmt, size):
+    # See parallel.print_samples_parallel()
+    sampler, fmt = sampler_and_fmt
+    deals, _, tries = sample_batch(sampler, size)
+    return format_deals(deals, fmt), tries
+
+
+def format_deals(deals, fmt):
+    # Like formats.format_deals(), but measured.
+    if not metrics.enabled:
+        return formats.format_deals(deals, fmt)
+    start = time.perf_counter()
+    data = formats.format_deals(deals, fmt)
+    metrics.observe('format', time.perf_counter() - start)
+    return data
+
+
+def print_samples(sampler, n, fmt, workers=1, ordered=False, out=None):
+    """
+    Prints `n` deals in the format `fmt` (see formats.FORMATS) to stdout (or
+    the binary file `out`), and the rate to stderr.
+    """
+    assert sampler[3] == 'NESW' or fmt in formats.TEXT_FORMATS + ('None',), 'Binary formats need whole deals'
+    batch_size = STRATIFIED_BATCH_SIZE if sampler[0] == '4suits_stratified' else DEFAULT_BATCH_SIZE
+    if workers > 1:
+        parallel.print_samples_parallel(format_chunk, (sampler, fmt), n, workers, ordered, chunk_size=batch_size, out=out)
+        return
+    if out is None:
+        out = sys.stdout.buffer
+    last_print = time.time()
+    i = 0
+    last_reported_i = 0
+    tries_total = 0
+    last_reported_tries = 0
+    while i < n:
+        # With rare constraints, a whole batch can take many tries. So the
+        # rejecting samplers return early, and there's still a report every
+        # REPORT_FRACTION tries (or deals, whichever comes first).
+        deals, _, tries = sample_batch(sampler, min(batch_size, n - i), max_tries=REPORT_FRACTION)
+        out.write(format_deals(deals, fmt))
+        i += len(deals)
+        tries_total += tries
+        if i - last_reported_i >= REPORT_FRACTION or tries_total - last_reported_tries >= REPORT_FRACTION:
+            this_print = time.time()
+            print('iter {}, about {}/s, about {} tries/s'.format(
+                    i, (i - last_reported_i) / (this_print - last_print), (tries_total - last_reported_tries) / (this_print - last_print)),
+                file=sys.stderr)
+            last_print = this_print
+            last_reported_i = i
+            last_reported_tries = tries_total
+    out.flush()
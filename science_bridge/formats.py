@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+
+import common
+import functools
+import randomness
+import sys
+import time
+
+# numpy, once loaded by have_numpy()
+np = None
+
+# Fast text formats for whole batches of deals.
+#
+# Formatting card by card (see common.deal_to_string()) costs more than sampling
+# the deal. Instead, each hand is turned into a 52-bit mask (bit i is card i),
+# and each 13-bit suit of that mask is looked up in a table of holding strings
+# (see Holdings). Sorting comes for free, as the bits are already in order.
+#
+# Text formats, one line per deal:
+# - 'int': The list of 52 cards, as in common.format_deal().
+# - 'str': "♣2 ♣6 ... ♠A   ♣3 ...", exactly as common.deal_to_string().
+# - 'pbn': A PBN Deal tag, e.g. [Deal "N:AK.QJ2.T98.76543 ..."], with North
+#   first, and each hand as spades.hearts.diamonds.clubs.
+# - 'lin': The "md" field of BBO's LIN format, e.g. md|3SAKHQJ2DT98C76543,...|,
+#   with South first (as LIN wants it), and North as the dealer.
+# - 'compact': Like 'pbn' without the tag, e.g. AK.QJ2.T98.76543 ... (North first).
+# All other formats of common.format_deal() are passed through.
+#
+# With numpy, larger batches take a faster path (see format_numpy()): Each line
+# is a fixed-width template, and the cards of all deals are written into it at once.
+#
+# The text formats also take deals with only some seats (see common.SEATS): 'int'
+# and 'str' just have fewer cards, 'pbn' and 'compact' write '-' for each missing
+# hand, and 'lin' leaves it empty.
+
+TEXT_FORMATS = ('int', 'str', 'pbn', 'lin', 'compact')
+FORMATS = ('None',) + TEXT_FORMATS + tuple(common.BINARY_RECORD_SIZES)
+
+SUIT_MASK = (1 << 13) - 1
+CARD_BITS = tuple(1 << card for card in range(52))
+# Ranks as PBN and LIN write them, from 2 to A.
+ASCII_RANKS = '23456789TJQKA'
+# LIN lists the hands starting with South. Dealer 3 is North.
+LIN_HAND_ORDER = (2, 3, 0, 1)
+LIN_DEALER = '3'
+# The number of cards in a deal -> which seats it has
+SEATS_BY_LENGTH = {13 * len(seats): seats for seats in common.SEATS}
+# Smaller batches aren't worth converting to numpy.
+NUMPY_MIN_BATCH = 32
+# Smaller batches only build the holdings they need, see Holdings.
+COMPLETE_HOLDINGS_MIN_BATCH = 1000
+
+
+class Holdings(dict):
+    # Maps 13-bit masks to holding strings, like a table, but builds each holding
+    # the first time it's needed: Building all 8192 takes longer than formatting
+    # a few deals (e.g. a short CLI run). For larger batches, the complete tuple
+    # is a bit faster to look up. `holding_of(holdings, mask)` builds one.
+    def __init__(self, holding_of):
+        super().__init__()
+        self.holding_of = holding_of
+
+    def __missing__(self, mask):
+        holding = self[mask] = self.holding_of(self, mask)
+        return holding
+
+
+def complete_holdings(holdings):
+    return tuple(holdings[mask] for mask in range(1 << 13))
+
+
+@functools.lru_cache(maxsize=None)
+def str_holdings(suit, complete):
+    """
+    Returns the holdings of `suit` as in common.deal_to_string(), each followed by
+    a space unless empty, e.g. '♣2 ♣6 ♣K '. Indexed by 13-bit masks, either as
+    Holdings, or (if `complete`) as a tuple.
+    """
+    def holding_of(holdings, mask):
+        if mask == 0:
+            return ''
+        # The lowest card, followed by the holding without it.
+        lowest = (mask & -mask).bit_length() - 1
+        return common.card_to_string(13 * suit + lowest) + ' ' + holdings[mask ^ (1 << lowest)]
+    holdings = Holdings(holding_of)
+    return complete_holdings(holdings) if complete else holdings
+
+
+@functools.lru_cache(maxsize=None)
+def ascii_holdings(complete):
+    """
+    Like str_holdings(), but with the highest card first, e.g. 'KT62'.
+    """
+    def holding_of(holdings, mask):
+        if mask == 0:
+            return ''
+        # The highest card, followed by the holding without it.
+        highest = mask.bit_length() - 1
+        return ASCII_RANKS[highest] + holdings[mask ^ (1 << highest)]
+    holdings = Holdings(holding_of)
+    return complete_holdings(holdings) if complete else holdings
+
+
+def hand_masks(deal):
+    # One mask for each hand that `deal` has.
+    bits = CARD_BITS.__getitem__
+    if len(deal) == 52:
+        return sum(map(bits, deal[0:13])), sum(map(bits, deal[13:26])), sum(map(bits, deal[26:39])), sum(map(bits, deal[39:52]))
+    assert len(deal) in SEATS_BY_LENGTH, len(deal)
+    return tuple(sum(map(bits, deal[start:start + 13])) for start in range(0, len(deal), 13))
+
+
+def seat_masks(deal):
+    # Like hand_masks(), but always for all four seats, with None for each missing one.
+    masks = hand_masks(deal)
+    if len(masks) == 4:
+        return masks
+    by_seat = [None] * 4
+    for hand, mask in zip(common.SEAT_HANDS[SEATS_BY_LENGTH[len(deal)]], masks):
+        by_seat[hand] = mask
+    return by_seat
+
+
+# Each format_*() takes a list of deals, and returns all lines as one string.
+
+def format_int(deals):
+    return ''.join(str(deal) + '\n' for deal in deals)
+
+
+def format_str(deals):
+    clubs, diamonds, hearts, spades = (str_holdings(suit, len(deals) >= COMPLETE_HOLDINGS_MIN_BATCH) for suit in range(4))
+    lines = []
+    for deal in deals:
+        # Each hand ends with a space, which becomes part of the separator.
+        lines.append('  '.join(
+            clubs[mask & SUIT_MASK] + diamonds[(mask >> 13) & SUIT_MASK] + hearts[(mask >> 26) & SUIT_MASK] + spades[mask >> 39]
+            for mask in hand_masks(deal))[:-1] + '\n')
+    return ''.join(lines)
+
+
+def format_pbn_hands(deals):
+    holdings = ascii_holdings(len(deals) >= COMPLETE_HOLDINGS_MIN_BATCH)
+    return [
+        ' '.join(
+            '-' if mask is None else
+            holdings[mask >> 39] + '.' + holdings[(mask >> 26) & SUIT_MASK] + '.' + holdings[(mask >> 13) & SUIT_MASK] + '.' + holdings[mask & SUIT_MASK]
+            for mask in seat_masks(deal))
+        for deal in deals]
+
+
+def format_pbn(deals):
+    return ''.join('[Deal "N:' + hands + '"]\n' for hands in format_pbn_hands(deals))
+
+
+def format_compact(deals):
+    return ''.join(hands + '\n' for hands in format_pbn_hands(deals))
+
+
+def format_lin(deals):
+    holdings = ascii_holdings(len(deals) >= COMPLETE_HOLDINGS_MIN_BATCH)
+    lines = []
+    for deal in deals:
+        masks = seat_masks(deal)
+        lines.append('md|' + LIN_DEALER + ','.join(
+            '' if mask is None else
+            'S' + holdings[mask >> 39] + 'H' + holdings[(mask >> 26) & SUIT_MASK] + 'D' + holdings[(mask >> 13) & SUIT_MASK] + 'C' + holdings[mask & SUIT_MASK]
+            for mask in (masks[2], masks[3], masks[0], masks[1])) + '|\n')
+    return ''.join(lines)
+
+
+# For format_numpy(): Each hand takes the same number of characters in every line.
+# In 'str', it's 13 cards of 2 characters each, separated by spaces. In the other
+# formats it's 13 ranks and 3 separators between the suits (plus the 'S' in front
+# for 'lin', which is part of the template).
+STR_HAND_WIDTH = 13 * 3 - 1
+ASCII_HAND_WIDTH = 13 + 3
+
+
+@functools.lru_cache(maxsize=None)
+def have_numpy():
+    """
+    Imports numpy on first use, as that takes longer than many short runs of the
+    CLIs. Without numpy, everything still works, just slower, see format_deals().
+    """
+    global np
+    try:
+        import numpy
+    except ImportError:
+        return False
+    np = numpy
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def numpy_card_codes():
+    """
+    Returns a tuple of arrays indexed by card: The code points of the suit and
+    of the rank in 'str', and of the rank in the other formats.
+    """
+    return (
+        np.array([ord(common.card_to_string(card)[0]) for card in range(52)], dtype='<u4'),
+        np.array([ord(common.card_to_string(card)[1]) for card in range(52)], dtype='<u4'),
+        np.array([ord(ASCII_RANKS[card % 13]) for card in range(52)], dtype=np.uint8),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def numpy_template(fmt, seats):
+    """
+    Returns a tuple (template, offsets): A line of `fmt` for deals with `seats`,
+    as a numpy array of code points, with blanks for the hands, and the offset
+    of each hand (in the order of the deal) in it.
+    """
+    present = common.SEAT_HANDS[seats]
+    parts = []
+    offsets = [None] * len(present)
+
+    def add_hand(seat, width):
+        offsets[present.index(seat)] = sum(map(len, parts))
+        parts.append(' ' * width)
+
+    if fmt == 'str':
+        for i, seat in enumerate(present):
+            if i > 0:
+                parts.append('   ')
+            add_hand(seat, STR_HAND_WIDTH)
+        parts.append('\n')
+    elif fmt in ('pbn', 'compact'):
+        if fmt == 'pbn':
+            parts.append('[Deal "N:')
+        for seat in range(4):
+            if seat > 0:
+                parts.append(' ')
+            if seat in present:
+                add_hand(seat, ASCII_HAND_WIDTH)
+            else:
+                parts.append('-')
+        parts.append('"]\n' if fmt == 'pbn' else '\n')
+    elif fmt == 'lin':
+        parts.append('md|' + LIN_DEALER)
+        for i, seat in enumerate(LIN_HAND_ORDER):
+            if i > 0:
+                parts.append(',')
+            if seat in present:
+                parts.append('S')
+                add_hand(seat, ASCII_HAND_WIDTH)
+        parts.append('|\n')
+    else:
+        raise AssertionError(fmt)
+    line = ''.join(parts)
+    return np.array([ord(c) for c in line], dtype='<u4' if fmt == 'str' else np.uint8), tuple(offsets)
+
+
+def format_numpy_int(cards):
+    # Like format_int(), for an array of shape (n, cards per deal). The numbers
+    # have 1 or 2 digits, so the positions are computed with a cumulative sum.
+    # Each card is followed by ', ', except the last one of each line by ']\n'.
+    widths = np.where(cards >= 10, 4, 3)
+    widths[:, 0] += 1  # '['
+    ends = np.cumsum(widths).reshape(cards.shape)
+    starts = ends - widths
+    out = np.empty(ends[-1, -1], dtype=np.uint8)
+    out[starts[:, 0]] = ord('[')
+    starts[:, 0] += 1
+    two_digits = cards >= 10
+    out[starts[two_digits]] = ord('0') + cards[two_digits] // 10
+    ones = starts + two_digits
+    out[ones] = ord('0') + cards % 10
+    out[ones[:, :-1] + 1] = ord(',')
+    out[ones[:, :-1] + 2] = ord(' ')
+    out[ones[:, -1] + 1] = ord(']')
+    out[ones[:, -1] + 2] = ord('\n')
+    return out.tobytes()
+
+
+def format_numpy(deals, fmt):
+    """
+    Like TEXT_FORMATTERS[fmt](deals).encode(), but much faster: As every line has
+    the same length (see numpy_template()), all lines are filled in at once.
+    All deals must have the same seats.
+    """
+    n = len(deals)
+    cards = np.frombuffer(b''.join(map(bytes, deals)), dtype=np.uint8).reshape(n, -1)
+    if fmt == 'int':
+        return format_numpy_int(cards)
+    # Each hand sorted from lowest to highest card
+    hands = np.sort(cards.reshape(n, -1, 13), axis=2)
+    template, offsets = numpy_template(fmt, SEATS_BY_LENGTH[13 * hands.shape[1]])
+    lines = np.tile(template, (n, 1))
+    str_suit_codes, str_rank_codes, ascii_rank_codes = numpy_card_codes()
+    if fmt == 'str':
+        for hand, offset in enumerate(offsets):
+            positions = offset + 3 * np.arange(13)
+            lines[:, positions] = str_suit_codes[hands[:, hand]]
+            lines[:, positions + 1] = str_rank_codes[hands[:, hand]]
+        return lines.tobytes().decode('utf-32-le').encode()
+    separators = b'...' if fmt != 'lin' else b'CDH'
+    rows = np.arange(n)
+    for hand, offset in enumerate(offsets):
+        # Highest card first, so spades first. Before each card are the
+        # separators of the suits above it.
+        cards = hands[:, hand, ::-1]
+        suits = (cards // 13).astype(np.intp)
+        np.put_along_axis(lines, offset + np.arange(13) + 3 - suits, ascii_rank_codes[cards], axis=1)
+        for suit in range(3):
+            # The separator in front of `suit` comes after all higher cards.
+            lines[rows, offset + (suits > suit).sum(axis=1) + 2 - suit] = separators[suit]
+    return lines.tobytes()
+
+
+TEXT_FORMATTERS = {
+    'int': format_int,
+    'str': format_str,
+    'pbn': format_pbn,
+    'lin': format_lin,
+    'compact': format_compact,
+}
+
+
+def format_deal(deal, fmt):
+    """
+    Like common.format_deal(), but faster, and with all FORMATS.
+    """
+    return format_deals([deal], fmt)
+
+
+def format_deals(deals, fmt):
+    """
+    Returns all `deals` in the format `fmt` as a single bytes object, ready to be
+    written in one go.
+    """
+    formatter = TEXT_FORMATTERS.get(fmt)
+    if formatter is None:
+        return b''.join(common.format_deal(deal, fmt) for deal in deals)
+    if len(deals) >= NUMPY_MIN_BATCH and have_numpy():
+        return format_numpy(deals, fmt)
+    return formatter(deals).encode()
+
+
+# == Parsing, mostly to check the above ==
+
+def parse_ascii_hand(suit_holdings):
+    # `suit_holdings` in the order spades, hearts, diamonds, clubs
+    assert len(suit_holdings) == 4, suit_holdings
+    return sorted(13 * (3 - i) + ASCII_RANKS.index(rank) for i, holding in enumerate(suit_holdings) for rank in holding)
+
+
+def parse_deal(line, fmt):
+    """
+    Inverse of format_deal() for the text formats. Each hand comes back sorted.
+    Also for deals with only some seats.
+    """
+    line = line.strip()
+    if fmt == 'int':
+        deal = [int(card) for card in line.strip('[]').split(',')]
+    elif fmt == 'str':
+        deal = [common.string_to_card(card_string) for hand in line.split('   ') for card_string in hand.split(' ')]
+    elif fmt in ('pbn', 'compact'):
+        if fmt == 'pbn':
+            assert line.startswith('[Deal "N:') and line.endswith('"]'), line
+            line = line[len('[Deal "N:'):-len('"]')]
+        deal = [card for hand in line.split(' ') if hand != '-' for card in parse_ascii_hand(hand.split('.'))]
+    elif fmt == 'lin':
+        assert line.startswith('md|' + LIN_DEALER) and line.endswith('|'), line
+        lin_hands = line[len('md|') + 1:-1].split(',')
+        hands = [None] * 4
+        for hand, lin_hand in zip(LIN_HAND_ORDER, lin_hands):
+            if not lin_hand:
+                hands[hand] = []
+                continue
+            spades, rest = lin_hand[1:].split('H')
+            hearts, rest = rest.split('D')
+            hands[hand] = parse_ascii_hand([spades, hearts] + rest.split('C'))
+        deal = [card for hand in hands for card in hand]
+    else:
+        raise AssertionError(fmt)
+    assert len(deal) in SEATS_BY_LENGTH and len(set(deal)) == len(deal) and all(0 <= card < 52 for card in deal), line
+    return deal
+
+
+def run_sanity_checks():
+    print('Running sanity checks ...', file=sys.stderr)
+    deal = list(range(52))
+    # North: all clubs, East: all diamonds, and so on.
+    assert format_deal(deal, 'pbn') == b'[Deal "N:...AKQJT98765432 ..AKQJT98765432. .AKQJT98765432.. AKQJT98765432..."]\n'
+    assert format_deal(deal, 'lin') == b'md|3SHAKQJT98765432DC,SAKQJT98765432HDC,SHDCAKQJT98765432,SHDAKQJT98765432C|\n'
+    for _ in range(200):
+        deal = common.sample_deal_by_rank()
+        common.shuffle_inplace(deal)
+        canonical = [card for hand in range(4) for card in sorted(deal[13 * hand:13 * (hand + 1)])]
+        assert format_deal(deal, 'str') == common.format_deal(deal, 'str')
+        assert format_deal(deal, 'int') == common.format_deal(deal, 'int')
+        for fmt in TEXT_FORMATS:
+            assert parse_deal(format_deal(deal, fmt).decode(), fmt) == (canonical if fmt != 'int' else deal), fmt
+    # Only some seats: North has all clubs, South all hearts.
+    assert format_deal(list(range(13)) + list(range(26, 39)), 'pbn') == b'[Deal "N:...AKQJT98765432 - .AKQJT98765432.. -"]\n'
+    assert format_deal(list(range(13)), 'lin') == b'md|3,,SHDCAKQJT98765432,|\n'
+    for seats in common.SEATS:
+        deal = common.select_seats(common.sample_deal_by_rank(), seats)
+        canonical = [card for hand in range(len(seats)) for card in sorted(deal[13 * hand:13 * (hand + 1)])]
+        for fmt in TEXT_FORMATS:
+            assert parse_deal(format_deal(deal, fmt).decode(), fmt) == (canonical if fmt != 'int' else deal), (fmt, seats)
+    # Holdings built on demand (in any order) agree with the complete tables.
+    assert [str_holdings(0, False)[mask] for mask in range((1 << 13) - 1, -1, -1)][::-1] == list(str_holdings(0, True))
+    assert [ascii_holdings(False)[mask] for mask in range((1 << 13) - 1, -1, -1)][::-1] == list(ascii_holdings(True))
+    deals = [common.sample_deal_by_rank() for _ in range(10)]
+    for fmt in FORMATS:
+        assert format_deals(deals, fmt) == b''.join(format_deal(deal, fmt) for deal in deals)
+    if have_numpy():
+        for seats in common.SEATS:
+            deals = [common.select_seats(common.sample_deal_by_rank(), seats) for _ in range(NUMPY_MIN_BATCH)]
+            for fmt, formatter in TEXT_FORMATTERS.items():
+                assert format_numpy(deals, fmt) == formatter(deals).encode(), (fmt, seats)
+    print('  Done', file=sys.stderr)
+
+
+def do_time_self(n=20000):
+    randomness.seed('formats/time')
+    deals = [common.sample_deal_by_rank() for _ in range(n)]
+    start = time.perf_counter()
+    for deal in deals:
+        common.format_deal(deal, 'str')
+    print('common.format_deal(..., "str"): {:.1f} us/deal'.format((time.perf_counter() - start) / n * 1e6), file=sys.stderr)
+    for fmt in TEXT_FORMATS:
+        start = time.perf_counter()
+        TEXT_FORMATTERS[fmt](deals).encode()
+        print('{}(...): {:.1f} us/deal'.format(TEXT_FORMATTERS[fmt].__name__, (time.perf_counter() - start) / n * 1e6), file=sys.stderr)
+        start = time.perf_counter()
+        format_deals(deals, fmt)
+        print('format_deals(..., {!r}): {:.1f} us/deal'.format(fmt, (time.perf_counter() - start) / n * 1e6), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    run_sanity_checks()
+    do_time_self()
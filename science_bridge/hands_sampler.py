@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import common
+import table
+
+
+# Exact sampler for deals where the suit lengths of *several* hands are constrained.
+#
+# First, the complete 4x4 matrix of suit lengths is drawn, one hand after
+# another: Each hand's shape is weighted by the number of ways to deal it from
+# the remaining cards, times the number of ways to complete the deal for the
+# later hands (within their constraints). These totals only depend on the hand
+# and the remaining cards per suit, so they are memoized (see
+# table.prepare_hands_state(), which table.count_table_hands() uses as well).
+# Then the cards of each suit are shuffled and handed out according to the matrix.
+# This never rejects anything, no matter how tight the constraints are.
+
+
+def prepare_hands(min_max_reqs_per_hand):
+    """
+    `min_max_reqs_per_hand` has 4 entries (North, East, South, West), each either
+    None (no restriction) or 8 integers, 2 for each suit.
+    Returns the sampler state, which memoizes everything computed so far.
+    Raises ValueError if the constraints cannot be satisfied.
+    """
+    assert len(min_max_reqs_per_hand) == 4
+    state = table.prepare_hands_state(min_max_reqs_per_hand)
+    state['choices'] = dict()
+    if count_completions(state, 0, (13, 13, 13, 13)) == 0:
+        raise ValueError('Constraints {} cannot be satisfied'.format(min_max_reqs_per_hand))
+    return state
+
+
+def count_completions(state, hand, remaining):
+    """
+    Returns the number of ways to deal the hands `hand`, ..., West from the
+    `remaining` cards, such that all constraints are satisfied.
+    """
+    return table.count_hands(state, hand, remaining)[0]
+
+
+def prepare_choices(state, hand, remaining):
+    key = (hand, remaining)
+    prepared = state['choices'].get(key)
+    if prepared is None:
+        weights = {
+            shape: ways * count_completions(state, hand + 1, new_remaining)
+            for shape, ways, new_remaining in table.gen_hands_options(state, hand, remaining)
+        }
+        prepared = table.prepare_table_int(weights)
+        state['choices'][key] = prepared
+    return prepared
+
+
+def sample_shapes(state):
+    """
+    Returns the suit lengths of all four hands, as a tuple of 16 integers (see table.count_table_hands()).
+    """
+    remaining = (13, 13, 13, 13)
+    key = ()
+    for hand in range(3):
+        shape = table.sample_prepared_int(prepare_choices(state, hand, remaining))
+        key += shape
+        remaining = tuple(left - length for left, length in zip(remaining, shape))
+    return key + remaining
+
+
+def sample_deal_hands(shapes, seats='NESW'):
+    """
+    Returns a uniformly random deal where the hands have exactly the suit lengths
+    `shapes` (16 integers, as returned by sample_shapes()). Only has the given
+    `seats`, see common.SEATS.
+    """
+    assert len(shapes) == 16
+    seat_hands = common.SEAT_HANDS[seats]
+    hands = [[] for _ in range(4)]
+    for suit_idx in range(4):
+        in_suit = list(range(13 * suit_idx, 13 * (suit_idx + 1)))
+        if seats == 'NESW':
+            common.shuffle_inplace(in_suit)
+        else:
+            # Only the cards of the requested seats need to be random.
+            common.shuffle_prefix_inplace(in_suit, sum(shapes[4 * hand + suit_idx] for hand in seat_hands))
+        start = 0
+        for hand in seat_hands:
+            length = shapes[4 * hand + suit_idx]
+            hands[hand].extend(in_suit[start:start + length])
+            start += length
+        assert start == 13 or seats != 'NESW'
+    deal = []
+    for hand in seat_hands:
+        assert len(hands[hand]) == 13
+        deal.extend(hands[hand])
+    return deal
+
+
+def run_sanity_checks():
+    print('Running sanity checks ...')
+    reqs = [(1, 3, 3, 5, 3, 6, 3, 6), None, (0, 13, 0, 13, 4, 13, 0, 13), None]
+    state = prepare_hands(reqs)
+    expected = sum(table.count_table_hands(3, reqs[:3]).values())
+    assert count_completions(state, 0, (13, 13, 13, 13)) == expected
+    for _ in range(100):
+        shapes = sample_shapes(state)
+        deal = sample_deal_hands(shapes)
+        assert sorted(deal) == list(range(52))
+        for hand in range(4):
+            hand_cards = deal[13 * hand:13 * (hand + 1)]
+            assert tuple(sum(1 for card in hand_cards if common.card_suit(card) == suit) for suit in range(4)) == shapes[4 * hand:4 * hand + 4]
+            if reqs[hand] is not None:
+                assert all(reqs[hand][2 * i] <= shapes[4 * hand + i] <= reqs[hand][2 * i + 1] for i in range(4))
+    for seats in common.SEATS:
+        shapes = sample_shapes(state)
+        deal = sample_deal_hands(shapes, seats)
+        assert len(deal) == 13 * len(seats) and len(set(deal)) == len(deal)
+        for i, hand in enumerate(common.SEAT_HANDS[seats]):
+            hand_cards = deal[13 * i:13 * (i + 1)]
+            assert tuple(sum(1 for card in hand_cards if common.card_suit(card) == suit) for suit in range(4)) == shapes[4 * hand:4 * hand + 4]
+    print('  Done')
+
+
+if __name__ == '__main__':
+    run_sanity_checks()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import common
+import fractions
+import functools
+import table
+
+
+# Exact sampler for deals where North's suit lengths *and* HPC are constrained.
+#
+# The HPC of a hand only depends on which honors (J, Q, K, A) North holds in
+# each suit. Within a suit of length L, a given honor set with k honors can be
+# completed by any k' = L - k of the 9 spot cards, so there are exactly
+# binomial(9, L - k) holdings with that honor set. Combining the four suits
+# gives the exact number of North hands for each (c, d, h, s, hpc), and sampling
+# from that table never needs to reject anything.
+
+SPOTS_PER_SUIT = 13 - common.HONORS_PER_SUIT
+
+
+# == Counting ==
+
+@functools.lru_cache(maxsize=None)
+def compute_suit_weights():
+    """
+    Returns a tuple indexed by suit length, each entry a dict mapping hpc to the
+    number of holdings with that length and hpc in a single suit.
+    """
+    # HPC don't depend on the suit, so just pick clubs.
+    by_length = table.compute_suit_points_counts(0, (table.evaluate_hpc,))
+    return tuple({points[0]: count for points, count in by_hpc.items()} for by_hpc in by_length)
+
+
+def convolve(weights_a, weights_b):
+    result = dict()
+    for hpc_a, count_a in weights_a.items():
+        for hpc_b, count_b in weights_b.items():
+            result[hpc_a + hpc_b] = result.get(hpc_a + hpc_b, 0) + count_a * count_b
+    return result
+
+
+@functools.lru_cache(maxsize=None)
+def compute_suffix_weights(lengths):
+    """
+    Returns a dict mapping hpc to the number of ways to hold exactly `lengths`
+    cards in the *last* len(lengths) suits with that total hpc.
+    """
+    if not lengths:
+        return {0: 1}
+    suit_weights = compute_suit_weights()[lengths[0]]
+    return convolve(suit_weights, compute_suffix_weights(lengths[1:]))
+
+
+def compute_table_4suits_hpc(min_max_reqs):
+    """
+    Returns a table mapping (c, d, h, s, hpc) to the number of North hands with
+    exactly these suit lengths and hpc, restricted to `min_max_reqs` (10 integers,
+    as in combined_sampler). Each entry is an integer; divide by binomial(52, 13)
+    to get the probability.
+    """
+    assert len(min_max_reqs) == 10
+    table_out = dict()
+    for cdhs_counts in table.gen_4suits_counts():
+        if not all(min_max_reqs[2 * i] <= cdhs_counts[i] <= min_max_reqs[2 * i + 1] for i in range(4)):
+            continue
+        for hpc, count in compute_suffix_weights(cdhs_counts).items():
+            if min_max_reqs[8] <= hpc <= min_max_reqs[9]:
+                table_out[cdhs_counts + (hpc,)] = count
+    return table_out
+
+
+@functools.lru_cache(maxsize=None)
+def prepare_suit_holdings(length, hpc):
+    """
+    Returns a prepared integer table (see table.prepare_table_int()) over the
+    honor sets that have exactly `hpc` and fit into a suit of `length` cards,
+    weighted by the number of ways to fill up with spot cards.
+    """
+    table_int = dict()
+    for honors in range(1 << common.HONORS_PER_SUIT):
+        num_honors = common.honors_count(honors)
+        if common.honors_hpc(honors) != hpc or not 0 <= length - num_honors <= SPOTS_PER_SUIT:
+            continue
+        table_int[honors] = common.binomial(SPOTS_PER_SUIT, length - num_honors)
+    return table.prepare_table_int(table_int)
+
+
+# == Sampling ==
+
+def sample_suit_hpcs(cdhs_counts, hpc):
+    """
+    Splits the total `hpc` across the four suits, with exactly the probability of
+    a uniformly chosen North hand with suit lengths `cdhs_counts` and that hpc.
+    """
+    suit_hpcs = []
+    remaining_hpc = hpc
+    for suit_idx in range(3):
+        suit_weights = compute_suit_weights()[cdhs_counts[suit_idx]]
+        suffix_weights = compute_suffix_weights(cdhs_counts[suit_idx + 1:])
+        choices = dict()
+        for suit_hpc, count in suit_weights.items():
+            suffix_count = suffix_weights.get(remaining_hpc - suit_hpc, 0)
+            if suffix_count > 0:
+                choices[suit_hpc] = count * suffix_count
+        suit_hpc = table.sample_table_int(choices)
+        suit_hpcs.append(suit_hpc)
+        remaining_hpc -= suit_hpc
+    suit_hpcs.append(remaining_hpc)
+    return suit_hpcs
+
+
+def sample_deal_4suits_hpc(cdhs_hpc, seats='NESW'):
+    """
+    Returns a uniformly random deal where North has exactly the given suit lengths
+    and hpc. `cdhs_hpc` is a key as returned by compute_table_4suits_hpc().
+    Only has the given `seats`, see common.SEATS. Never needs to retry.
+    """
+    assert len(cdhs_hpc) == 5
+    cdhs_counts = cdhs_hpc[:4]
+    assert sum(cdhs_counts) == 13
+
+    deal = []
+    remaining_cards = []
+    for suit_idx, (suit_count, suit_hpc) in enumerate(zip(cdhs_counts, sample_suit_hpcs(cdhs_counts, cdhs_hpc[4]))):
+        honors = table.sample_prepared_int(prepare_suit_holdings(suit_count, suit_hpc))
+        num_spots = suit_count - common.honors_count(honors)
+        spots = list(range(13 * suit_idx, 13 * suit_idx + SPOTS_PER_SUIT))
+        if seats == 'NESW':
+            common.shuffle_inplace(spots)
+        else:
+            common.shuffle_prefix_inplace(spots, num_spots)
+        deal.extend(spots[:num_spots])
+        if seats == 'N':
+            # Nobody needs the rest.
+            deal.extend(13 * suit_idx + SPOTS_PER_SUIT + honor_idx for honor_idx in range(common.HONORS_PER_SUIT) if honors & (1 << honor_idx))
+            continue
+        remaining_cards.extend(spots[num_spots:])
+        for honor_idx in range(common.HONORS_PER_SUIT):
+            card = 13 * suit_idx + SPOTS_PER_SUIT + honor_idx
+            if honors & (1 << honor_idx):
+                deal.append(card)
+            else:
+                remaining_cards.append(card)
+    assert len(deal) == 13
+
+    # Then, deal the rest randomly:
+    common.deal_other_seats(deal, remaining_cards, seats)
+    assert len(deal) == 13 * len(seats)
+    return deal
+
+
+def run_sanity_checks():
+    print('Running sanity checks ...')
+    print('  Checking suit weights ...')
+    for length, by_hpc in enumerate(compute_suit_weights()):
+        assert sum(by_hpc.values()) == common.binomial(13, length), length
+    print('  Checking 4 suits hpc table ...')
+    everything = compute_table_4suits_hpc((0, 13) * 4 + (0, 40))
+    assert sum(everything.values()) == common.binomial(52, 13)
+    shape_totals = dict()
+    for cdhs_hpc, count in everything.items():
+        shape_totals[cdhs_hpc[:4]] = shape_totals.get(cdhs_hpc[:4], 0) + count
+    for cdhs_counts, p in table.compute_table_4suits().items():
+        assert p == fractions.Fraction(shape_totals[cdhs_counts], common.binomial(52, 13)), cdhs_counts
+    print('  Checking sampled deals ...')
+    for key in [(0, 2, 4, 7, 26), (4, 3, 3, 3, 10), (13, 0, 0, 0, 10), (3, 3, 3, 4, 37)]:
+        deal = sample_deal_4suits_hpc(key)
+        assert sorted(deal) == list(range(52))
+        north = deal[:13]
+        assert tuple(sum(1 for card in north if common.card_suit(card) == i) for i in range(4)) == key[:4]
+        assert common.count_hpc(north) == key[4]
+    print('  Checking partial deals ...')
+    for seats in common.SEATS:
+        for key in [(0, 2, 4, 7, 26), (13, 0, 0, 0, 10)]:
+            deal = sample_deal_4suits_hpc(key, seats)
+            assert len(deal) == 13 * len(seats) and len(set(deal)) == len(deal)
+            assert common.count_hpc(deal[:13]) == key[4]
+    # South's cards have the same distribution as in the whole deals.
+    n = 5000
+    for sample in (sample_deal_4suits_hpc, common.sample_deal_4suits):
+        key = (4, 3, 3, 3, 10)[:5 if sample is sample_deal_4suits_hpc else 4]
+        whole_counts = [0] * 52
+        partial_counts = [0] * 52
+        for _ in range(n):
+            for card in sample(key)[26:39]:
+                whole_counts[card] += 1
+            for card in sample(key, 'NS')[13:]:
+                partial_counts[card] += 1
+        for card in range(52):
+            assert abs(whole_counts[card] - partial_counts[card]) <= 5 * (whole_counts[card] + partial_counts[card]) ** 0.5 + 5, (sample, card)
+    print('  Done')
+
+
+if __name__ == '__main__':
+    run_sanity_checks()
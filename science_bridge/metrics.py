@@ -0,0 +1,130 @@
+#!/bin/false
+
+import atexit
+import collections
+import common
+import json
+import os
+import time
+
+# Counters and timing histograms for the sampling hot paths.
+#
+# Disabled by default, and then costs one check of `metrics.enabled` per call
+# site. Enabled by calling enable(), or by setting the environment variable
+# SCIENCE_BRIDGE_METRICS to a filename: Then a JSON snapshot (see snapshot()) is
+# written to that file every DUMP_SECONDS, and at exit. With several worker
+# processes, put "{pid}" into the filename, so that each gets its own file
+# (workers write theirs after each chunk).
+#
+# Call sites look like this:
+#
+#     if metrics.enabled:
+#         start = time.perf_counter()
+#     ...
+#     if metrics.enabled:
+#         metrics.observe('shuffle', time.perf_counter() - start)
+
+METRICS_ENV_VAR = 'SCIENCE_BRIDGE_METRICS'
+DUMP_SECONDS = 10
+
+enabled = False
+dump_filename = None
+last_dump = 0
+counters = collections.Counter()
+# name -> key -> count, e.g. the attempts per shape
+keyed_counters = collections.defaultdict(collections.Counter)
+# name -> [count, total seconds, Counter of buckets]. Bucket b holds durations
+# of less than 2**b microseconds (and at least 2**(b-1)).
+histograms = dict()
+
+
+def enable(filename=None):
+    global enabled, dump_filename, last_dump
+    enabled = True
+    dump_filename = filename
+    last_dump = time.time()
+
+
+def reset():
+    counters.clear()
+    keyed_counters.clear()
+    histograms.clear()
+
+
+def increment(name, amount=1):
+    counters[name] += amount
+
+
+def increment_keyed(name, key, amount=1):
+    keyed_counters[name][key] += amount
+
+
+def observe(name, seconds):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = [0, 0.0, collections.Counter()]
+        histograms[name] = histogram
+    histogram[0] += 1
+    histogram[1] += seconds
+    histogram[2][int(seconds * 1e6).bit_length()] += 1
+    maybe_dump()
+
+
+def key_to_string(key):
+    return ','.join(str(x) for x in key) if isinstance(key, tuple) else str(key)
+
+
+def snapshot():
+    """
+    Returns everything as a JSON-compatible dict. For each pair of keyed counters
+    named 'X_attempts' and 'X_accepts', also has the acceptance rate per key as 'X_acceptance'.
+    """
+    keyed = {name: {key_to_string(key): count for key, count in sorted(by_key.items())} for name, by_key in keyed_counters.items()}
+    for name in list(keyed.keys()):
+        if name.endswith('_attempts') and name[:-len('_attempts')] + '_accepts' in keyed:
+            prefix = name[:-len('_attempts')]
+            accepts = keyed[prefix + '_accepts']
+            keyed[prefix + '_acceptance'] = {key: accepts.get(key, 0) / attempts for key, attempts in keyed[name].items()}
+    return {
+        'time': time.time(),
+        'pid': os.getpid(),
+        'counters': dict(counters),
+        'keyed_counters': keyed,
+        'histograms': {
+            name: {
+                'count': count,
+                'total_seconds': total,
+                'mean_seconds': total / count,
+                'buckets_below_us': {str(1 << bucket): n for bucket, n in sorted(buckets.items())},
+            }
+            for name, (count, total, buckets) in histograms.items()
+        },
+    }
+
+
+def dump(filename=None):
+    filename = (filename or dump_filename).format(pid=os.getpid())
+    common.write_file_atomically(filename, json.dumps(snapshot(), indent=1).encode())
+
+
+def maybe_dump():
+    global last_dump
+    if dump_filename is None:
+        return
+    now = time.time()
+    if now - last_dump >= DUMP_SECONDS:
+        last_dump = now
+        dump()
+
+
+def dump_at_exit():
+    if enabled and dump_filename is not None:
+        dump()
+
+
+if os.environ.get(METRICS_ENV_VAR):
+    enable(os.environ[METRICS_ENV_VAR])
+atexit.register(dump_at_exit)
+# Worker processes start counting from scratch.
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset)
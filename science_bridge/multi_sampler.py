@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import deal_stream
+import parallel
+import randomness
+import sys
+
+# Samples deals where the suit lengths of several hands are constrained, see hands_sampler.
+
+FORMAT = 'str'  # 'None' or 'int' or 'str' or 'pbn' or 'lin' or 'compact' or 'bin52' or 'bin13' or 'bin12', see formats.py
+SEATS = 'NESW'  # 'NESW' (whole deals) or 'NS' or 'N' (only deal these seats, faster; text formats only), see common.SEATS
+
+DEFAULT_NUM_SAMPLES = 10
+
+
+def parse_hand_reqs(args):
+    # "-" means "no restriction" for this hand
+    if args == ['-']:
+        return None
+    assert len(args) == 8
+    return tuple(int(x) for x in args)
+
+
+def run_with(num_samples, min_max_reqs_per_hand, workers=1, ordered=False):
+    try:
+        sampler = deal_stream.prepare_hands(min_max_reqs_per_hand, SEATS)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    deal_stream.print_samples(sampler, num_samples, FORMAT, workers, ordered)
+
+
+if __name__ == '__main__':
+    try:
+        args, workers, ordered, seed = parallel.split_options(sys.argv[1:])
+    except ValueError as e:
+        # Falls through to the usage below.
+        print(e, file=sys.stderr)
+        args, workers, ordered, seed = [], 1, False, None
+    if seed is not None:
+        randomness.seed(seed)
+    # Split into groups, separated by '/'
+    groups = [[]]
+    for arg in args:
+        if arg == '/':
+            groups.append([])
+        else:
+            groups[-1].append(arg)
+    num_samples = DEFAULT_NUM_SAMPLES
+    if len(groups) == 5 and len(groups[4]) == 1:
+        num_samples = int(groups.pop()[0])
+    if len(groups) == 4 and all(group == ['-'] or len(group) == 8 for group in groups):
+        run_with(num_samples, [parse_hand_reqs(group) for group in groups], workers=workers, ordered=ordered)
+    else:
+        print('USAGE: {} [OPTIONS] <NORTH> / <EAST> / <SOUTH> / <WEST> [/ <NUM_SAMPLES>]'.format(sys.argv[0]), file=sys.stderr)
+        print('Each hand is either 8 integers, 2 for each suit, describing the minimum and', file=sys.stderr)
+        print('maximum interesting amount, or "-" for "no restriction".', file=sys.stderr)
+        print('NUM_SAMPLES is the number of samples to print. Defaults to {}'.format(DEFAULT_NUM_SAMPLES), file=sys.stderr)
+        parallel.print_options_usage()
+        exit(1)
@@ -1,15 +1,38 @@
 #!/usr/bin/env python3
 
-import atomicwrites
-import collections
+import batch_sampler
 import common
+import itertools
 import json
-import random
-import secrets  # If this fails, update to python 3.7 or newer
+import multiprocessing
+import numpy as np
+import os
+import parallel
+import randomness
+import struct
+import sys
 import time
 
 
-INCREMENT = 10000
+# Counts suit lengths and HPC of all four hands of many uniformly random deals,
+# so that table.py can check the computed probabilities against them.
+#
+# Each worker counts whole chunks of deals in batches (see batch_sampler), and the
+# parent merges the histograms. Every CHECKPOINT_SECONDS, it writes:
+# - a binary checkpoint (see write_checkpoint()), from which the run can be
+#   continued later, and
+# - a JSON file for `table.py`, as [total, north_shape_counts, extra], where the
+#   keys of north_shape_counts are c * 1000000 + d * 10000 + h * 100 + s, and
+#   `extra` has the shape counts of all hands and the HPC histograms.
+
+CHUNK_SIZE = 1 << 20
+BATCH_SIZE = 1 << 16
+CHECKPOINT_SECONDS = 60
+CHECKPOINT_MAGIC = b'SBCOUNT1'
+CHECKPOINT_HEADER = struct.Struct('<8sQQQ')  # magic, chunk size, chunks done, total deals
+# A shape (c, d, h, s) is counted at index (c * 14 + d) * 14 + h, as s is implied.
+SHAPE_BINS = 14 ** 3
+HPC_BINS = 37 + 1
 
 
 def generate_deals():
@@ -20,29 +43,148 @@ def generate_deals():
         assert len(l) == 52, 'Ey!'
 
 
-def do_time_self():
-    gen = generate_deals()
-    new_time = time.time()
-    suit_counts = collections.Counter()
-    filename = time.strftime('empiric_counts_%s.json')
-    print('Writing to {}'.format(filename))
-    total = 0
-    while True:
-        for _ in range(INCREMENT):
-            hand_suit_counts = collections.Counter(i // 13 for i in next(gen)[:13])
-            assert hand_suit_counts[0] + hand_suit_counts[1] + hand_suit_counts[2] + hand_suit_counts[3] == 13
-            suit_counts[hand_suit_counts[0] * 1000000 + hand_suit_counts[1] * 10000 + hand_suit_counts[2] * 100 + hand_suit_counts[3]] += 1
-        total += INCREMENT
-        last_time = new_time
-        new_time = time.time()
-        print('{} ms / iter – {}: {}'.format(
-            1000 * (new_time - last_time) / INCREMENT,
-            total,
-            suit_counts.most_common()[:20]))
-        with atomicwrites.atomic_write(filename, overwrite=True) as fp:
-            json.dump([total, suit_counts], fp, separators=',:')
+def new_counts():
+    # Indexed by [hand, shape index] and [hand, hpc]
+    return np.zeros((4, SHAPE_BINS), dtype=np.int64), np.zeros((4, HPC_BINS), dtype=np.int64)
+
+
+def count_chunk(batch_size, size):
+    # See parallel.run_chunk(). Like everything else, `rng` follows randomness.seed().
+    rng = batch_sampler.RandomnessGenerator()
+    shape_counts, hpc_counts = new_counts()
+    hand_offsets = np.arange(4)
+    done = 0
+    while done < size:
+        deals = batch_sampler.generate_deal_batch(min(batch_size, size - done), rng)
+        suits = batch_sampler.count_suits(deals).astype(np.intp)
+        shape_idx = (suits[:, :, 0] * 14 + suits[:, :, 1]) * 14 + suits[:, :, 2]
+        shape_counts += np.bincount((shape_idx + hand_offsets * SHAPE_BINS).ravel(), minlength=4 * SHAPE_BINS).reshape(4, SHAPE_BINS)
+        hpc_idx = batch_sampler.count_hpc(deals).astype(np.intp)
+        hpc_counts += np.bincount((hpc_idx + hand_offsets * HPC_BINS).ravel(), minlength=4 * HPC_BINS).reshape(4, HPC_BINS)
+        done += deals.shape[0]
+    return (shape_counts, hpc_counts), size
+
+
+def write_checkpoint(filename, chunk_size, chunks_done, total, counts):
+    """
+    The checkpoint is CHECKPOINT_HEADER, followed by the shape counts and then the
+    HPC counts, as little-endian 64-bit integers.
+    """
+    shape_counts, hpc_counts = counts
+    header = CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, chunk_size, chunks_done, total)
+    common.write_file_atomically(filename, header + shape_counts.astype('<i8').tobytes() + hpc_counts.astype('<i8').tobytes())
+
+
+def read_checkpoint(filename):
+    """
+    Returns a tuple (chunk_size, chunks_done, total, counts), see write_checkpoint().
+    """
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+    shape_counts, hpc_counts = new_counts()
+    expected_size = CHECKPOINT_HEADER.size + 8 * (shape_counts.size + hpc_counts.size)
+    if len(data) != expected_size:
+        raise ValueError('{} has {} bytes, expected {}'.format(filename, len(data), expected_size))
+    magic, chunk_size, chunks_done, total = CHECKPOINT_HEADER.unpack_from(data)
+    if magic != CHECKPOINT_MAGIC:
+        raise ValueError('{} is not a checkpoint'.format(filename))
+    counts = np.frombuffer(data, dtype='<i8', offset=CHECKPOINT_HEADER.size).astype(np.int64)
+    shape_counts[:] = counts[:shape_counts.size].reshape(shape_counts.shape)
+    hpc_counts[:] = counts[shape_counts.size:].reshape(hpc_counts.shape)
+    assert (shape_counts.sum(axis=1) == total).all() and (hpc_counts.sum(axis=1) == total).all()
+    return chunk_size, chunks_done, total, (shape_counts, hpc_counts)
+
+
+def shape_key(shape_idx):
+    c, rest = divmod(shape_idx, 14 * 14)
+    d, h = divmod(rest, 14)
+    return c * 1000000 + d * 10000 + h * 100 + (13 - c - d - h)
+
+
+def write_json(filename, total, counts):
+    shape_counts, hpc_counts = counts
+    shapes_by_hand = [{shape_key(i): int(v) for i, v in enumerate(hand_counts) if v} for hand_counts in shape_counts.tolist()]
+    extra = {
+        'hand_shape_counts': shapes_by_hand,
+        'hand_hpc_counts': hpc_counts.tolist(),
+    }
+    common.write_file_atomically(filename, json.dumps([total, shapes_by_hand[0], extra], separators=(',', ':')).encode())
+
+
+def do_time_self(base_filename=None, workers=1, num_deals=None):
+    """
+    Counts deals until interrupted (or until `num_deals` are done), writing to
+    `base_filename` + '.counts' and '.json'. If the '.counts' file already exists,
+    continues from there.
+    """
+    if base_filename is None:
+        base_filename = time.strftime('empiric_counts_%s')
+    checkpoint_filename = base_filename + '.counts'
+    json_filename = base_filename + '.json'
+    if os.path.exists(checkpoint_filename):
+        chunk_size, chunks_done, total, counts = read_checkpoint(checkpoint_filename)
+        print('Continuing {} at {} deals'.format(checkpoint_filename, total), file=sys.stderr)
+    else:
+        chunk_size, chunks_done, total, counts = CHUNK_SIZE, 0, 0, new_counts()
+        print('Writing to {} and {}'.format(checkpoint_filename, json_filename), file=sys.stderr)
+
+    def gen_chunks(first_chunk_idx, remaining):
+        # In seeded mode, chunk i always gets the same deals, even across restarts.
+        for chunk_idx in itertools.count(first_chunk_idx):
+            if remaining is not None and remaining <= 0:
+                return
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            yield chunk_idx, size
+            if remaining is not None:
+                remaining -= size
+
+    def save():
+        write_checkpoint(checkpoint_filename, chunk_size, chunks_done, total, counts)
+        write_json(json_filename, total, counts)
+
+    base_seed = randomness.seed_value if randomness.is_seeded() else None
+    start_time = time.time()
+    start_total = total
+    last_save = start_time
+    with multiprocessing.Pool(workers, initializer=parallel.init_worker, initargs=(count_chunk, BATCH_SIZE, base_seed)) as pool:
+        try:
+            # Ordered, so that the checkpoint always covers exactly the first `chunks_done` chunks.
+            for size, chunk_counts, _ in pool.imap(parallel.run_chunk, gen_chunks(chunks_done, None if num_deals is None else num_deals - total)):
+                counts[0][:] += chunk_counts[0]
+                counts[1][:] += chunk_counts[1]
+                chunks_done += 1
+                total += size
+                now = time.time()
+                print('{} deals, about {}/s (all {} workers)'.format(total, (total - start_total) / (now - start_time), workers), file=sys.stderr)
+                if now - last_save >= CHECKPOINT_SECONDS:
+                    save()
+                    last_save = now
+        finally:
+            save()
+
+
+def print_usage():
+    print('USAGE: {} [OPTIONS] [<BASE_FILENAME> [<NUM_DEALS>]]'.format(sys.argv[0]), file=sys.stderr)
+    print('Counts suit lengths and HPC of random deals, until interrupted or NUM_DEALS are done.', file=sys.stderr)
+    print('Writes BASE_FILENAME.counts (to continue later) and BASE_FILENAME.json (for table.py).', file=sys.stderr)
+    print('If BASE_FILENAME.counts exists, continues from there. BASE_FILENAME defaults to empiric_counts_<TIMESTAMP>.', file=sys.stderr)
+    parallel.print_options_usage()
 
 
 if __name__ == '__main__':
+    try:
+        args, workers, _, seed = parallel.split_options(sys.argv[1:])
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        print_usage()
+        exit(1)
+    if seed is not None:
+        randomness.seed(seed)
+    if len(args) > 2:
+        print_usage()
+        exit(1)
     print(common.deal_to_string(next(generate_deals())))
-    do_time_self()
+    try:
+        do_time_self(*args[:1], workers=workers, num_deals=int(args[1]) if len(args) == 2 else None)
+    except KeyboardInterrupt:
+        pass
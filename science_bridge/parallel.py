@@ -0,0 +1,120 @@
+#!/bin/false
+
+import metrics
+import multiprocessing
+import randomness
+import sys
+import time
+
+# Spread the sampling across several processes. Each task is a "chunk" of deals,
+# which a worker samples and formats on its own. The parent process only writes
+# the already-formatted chunks to stdout and reports the rate.
+
+DEFAULT_CHUNK_SIZE = 1000
+REPORT_FRACTION = 10000
+
+# Set once per worker process by init_worker(), so that the (possibly large) shared
+# data is transferred once per worker, and not once per chunk.
+worker_state = None
+
+
+def init_worker(sample_chunk, shared, base_seed):
+    global worker_state
+    worker_state = (sample_chunk, shared, base_seed)
+
+
+def run_chunk(chunk_idx_and_size):
+    chunk_idx, size = chunk_idx_and_size
+    sample_chunk, shared, base_seed = worker_state
+    if base_seed is not None:
+        # Each chunk gets its own stream, no matter which worker runs it.
+        randomness.seed('{}/chunk{}'.format(base_seed, chunk_idx))
+    data, tries = sample_chunk(shared, size)
+    if metrics.enabled and metrics.dump_filename is not None:
+        # Workers are terminated without running atexit handlers.
+        metrics.dump()
+    return size, data, tries
+
+
+def gen_chunk_sizes(n, chunk_size):
+    chunk_idx = 0
+    while n > 0:
+        size = min(n, chunk_size)
+        yield chunk_idx, size
+        chunk_idx += 1
+        n -= size
+
+
+def print_samples_parallel(sample_chunk, shared, n, workers, ordered=False, chunk_size=DEFAULT_CHUNK_SIZE, out=None):
+    """
+    Prints `n` samples using `workers` processes.
+    `sample_chunk(shared, size)` must be a module-level function, and return a
+    tuple (data, tries) where `data` are the bytes of `size` formatted deals
+    (see common.format_deal()), and `tries` is the number of tries it took.
+    If `ordered` is true, chunks are printed in the order they were submitted,
+    otherwise as soon as they are done (which is a bit faster).
+    In seeded mode (see randomness.seed()), each chunk is seeded on its own, so
+    with `ordered` the output is reproducible, independent of `workers`.
+    `out` is a binary file to write to instead of stdout.
+    """
+    assert workers >= 1
+    if out is None:
+        out = sys.stdout.buffer
+    base_seed = randomness.seed_value if randomness.is_seeded() else None
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(sample_chunk, shared, base_seed)) as pool:
+        if ordered:
+            results = pool.imap(run_chunk, gen_chunk_sizes(n, chunk_size))
+        else:
+            results = pool.imap_unordered(run_chunk, gen_chunk_sizes(n, chunk_size))
+        last_print = time.time()
+        i = 0
+        last_reported_i = 0
+        tries_total = 0
+        last_reported_tries = 0
+        for size, data, tries in results:
+            out.write(data)
+            i += size
+            tries_total += tries
+            if i - last_reported_i >= REPORT_FRACTION:
+                this_print = time.time()
+                print('iter {}, about {}/s, about {} tries/s (all {} workers)'.format(
+                        i, (i - last_reported_i) / (this_print - last_print), (tries_total - last_reported_tries) / (this_print - last_print), workers),
+                    file=sys.stderr)
+                last_print = this_print
+                last_reported_i = i
+                last_reported_tries = tries_total
+    out.flush()
+
+
+def split_options(argv):
+    """
+    Removes the options '--workers N', '--ordered', and '--seed S' from `argv`.
+    Returns a tuple (remaining_argv, workers, ordered, seed). Raises ValueError
+    if an option is missing its value, or N isn't a positive number.
+    """
+    remaining_argv = []
+    workers = 1
+    ordered = False
+    seed = None
+    args = iter(argv)
+    for arg in args:
+        if arg == '--workers':
+            workers = next(args, '0')
+            if not workers.isdigit() or int(workers) < 1:
+                raise ValueError('--workers needs a positive number')
+            workers = int(workers)
+        elif arg == '--ordered':
+            ordered = True
+        elif arg == '--seed':
+            seed = next(args, None)
+            if seed is None:
+                raise ValueError('--seed needs a value')
+        else:
+            remaining_argv.append(arg)
+    return remaining_argv, workers, ordered, seed
+
+
+def print_options_usage():
+    print('OPTIONS can be "--workers N" to sample with N processes in parallel,', file=sys.stderr)
+    print('"--ordered" to print the samples in the order they were requested, and', file=sys.stderr)
+    print('"--seed S" to make the output reproducible (NOT suitable for actual games!).', file=sys.stderr)
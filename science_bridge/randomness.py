@@ -0,0 +1,154 @@
+#!/bin/false
+
+import os
+import random
+import threading
+
+# All randomness of the samplers goes through this module.
+#
+# Random bytes are fetched in large blocks, so that a deal doesn't need dozens of
+# syscalls. Integers are drawn by taking just enough bits and rejecting values
+# that are too large, so every draw is *exactly* uniform (no float rounding, no
+# modulo bias).
+#
+# By default, the bytes come from os.urandom(). After seed() they come from a
+# seeded PRNG instead, so that runs can be reproduced exactly (e.g. in tests and
+# benchmarks). Don't use seeded mode for anything that needs unpredictable deals.
+#
+# The buffer is shared by all threads (e.g. deal_stream.aiter_deals() samples in
+# executor threads), so it is only touched while holding `lock`. Otherwise two
+# threads could read the same bytes, and deal the same cards.
+
+BLOCK_SIZE = 4096
+
+# If None, use os.urandom(). Otherwise, a random.Random instance.
+seeded_source = None
+seed_value = None
+buffer = b''
+buffer_pos = 0
+lock = threading.Lock()
+
+
+def seed(value):
+    """
+    Switches to deterministic mode. `value` can be an int or a str.
+    Use seed(None) to switch back to os.urandom().
+    """
+    global seeded_source, seed_value, buffer, buffer_pos
+    with lock:
+        seed_value = value
+        seeded_source = None if value is None else random.Random(value)
+        buffer = b''
+        buffer_pos = 0
+
+
+def is_seeded():
+    return seeded_source is not None
+
+
+def forget_buffer():
+    # A forked child process must not reuse the random bytes that its parent is
+    # still going to use.
+    global buffer, buffer_pos, lock
+    # Another thread of the parent may have held the lock while forking.
+    lock = threading.Lock()
+    buffer = b''
+    buffer_pos = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=forget_buffer)
+
+
+def fetch(size):
+    # Only call while holding `lock`.
+    if seeded_source is None:
+        return os.urandom(size)
+    return seeded_source.getrandbits(8 * size).to_bytes(size, 'little')
+
+
+def refill(nbytes):
+    # Only call while holding `lock`.
+    global buffer, buffer_pos
+    buffer = buffer[buffer_pos:] + fetch(max(BLOCK_SIZE, nbytes))
+    buffer_pos = 0
+
+
+def randbytes_holding_lock(nbytes):
+    # Like randbytes(), but the caller already holds `lock`.
+    global buffer_pos
+    if nbytes > BLOCK_SIZE:
+        # Large requests (e.g. whole batches for batch_sampler) don't go through
+        # the buffer, which would only copy them around.
+        return fetch(nbytes)
+    if buffer_pos + nbytes > len(buffer):
+        refill(nbytes)
+    result = buffer[buffer_pos:buffer_pos + nbytes]
+    buffer_pos += nbytes
+    return result
+
+
+def randbytes(nbytes):
+    with lock:
+        return randbytes_holding_lock(nbytes)
+
+
+def randbits(k):
+    """
+    Returns a uniformly random integer in range(2 ** k).
+    """
+    assert k >= 0
+    return int.from_bytes(randbytes((k + 7) // 8), 'little') & ((1 << k) - 1)
+
+
+def randbelow_holding_lock(n):
+    # Like randbelow(), but the caller already holds `lock`. The shuffles take
+    # the lock once, instead of once per card.
+    global buffer_pos
+    assert n > 0
+    k = (n - 1).bit_length()
+    if k <= 8:
+        # Fast path for the small numbers used when shuffling.
+        mask = (1 << k) - 1
+        while True:
+            if buffer_pos >= len(buffer):
+                refill(1)
+            value = buffer[buffer_pos] & mask
+            buffer_pos += 1
+            if value < n:
+                return value
+    mask = (1 << k) - 1
+    while True:
+        value = int.from_bytes(randbytes_holding_lock((k + 7) // 8), 'little') & mask
+        if value < n:
+            return value
+
+
+def randbelow(n):
+    """
+    Returns a uniformly random integer in range(n). Works for arbitrarily large n.
+    """
+    with lock:
+        return randbelow_holding_lock(n)
+
+
+def shuffle_inplace(l):
+    # Fisher-Yates
+    with lock:
+        for i in range(len(l) - 1, 0, -1):
+            j = randbelow_holding_lock(i + 1)
+            l[i], l[j] = l[j], l[i]
+
+
+def shuffle_prefix_inplace(l, k):
+    """
+    Like shuffle_inplace(), but only the first `k` entries end up uniformly random
+    (a uniformly random selection, in random order). The others are left in no
+    particular order. Only needs k random numbers.
+    """
+    n = len(l)
+    assert 0 <= k <= n
+    with lock:
+        for i in range(k):
+            j = i + randbelow_holding_lock(n - i)
+            l[i], l[j] = l[j], l[i]
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+import asyncio
+import common
+import deal_stream
+import formats
+import fractions
+import functools
+import hpc_sampler
+import json
+import os
+import sys
+import table
+import traceback
+
+# Long-running server, so that many small questions don't each pay for
+# interpreter startup and building tables.
+#
+# Requests and responses are JSON objects, one per line. Each request may carry
+# an "id", which is copied into all responses to it. Requests of one client are
+# handled concurrently, so responses may arrive in a different order.
+#
+# {"id": 1, "op": "probability", "min_max_reqs": [0, 13, 0, 13, 0, 13, 5, 13, 15, 17]}
+#   -> {"id": 1, "numerator": ..., "denominator": ..., "float": ...}
+#   Exact probability that North's hand satisfies min_max_reqs (10 integers, as
+#   for combined_sampler), which is 0 if they cannot be satisfied. With an
+#   additional "given": [10 integers], it's the conditional probability instead
+#   (and an error if "given" cannot be satisfied).
+#
+# {"id": 2, "op": "sample", "min_max_reqs": [...], "count": 1000, "format": "str", "seats": "NESW"}
+#   -> {"id": 2, "deal": "♣2 ..."} for each deal, then {"id": 2, "done": true}
+#   "format" is "str" (default), "pbn", "lin", "compact" (see formats.py), or
+#   "int" (a list of cards). "seats" is "NESW" (default), "NS", or "N", see
+#   common.SEATS: Then each deal only has those hands.
+#
+# Any error is reported as {"id": ..., "error": "..."}. Unexpected errors are also
+# logged to stderr, with the traceback.
+
+USAGE = '''USAGE: {0} --stdin
+   or: {0} --socket <PATH>
+Answers newline-delimited JSON requests, see the top of server.py.'''
+
+CACHE_SIZE = 128
+SAMPLE_CHUNK_SIZE = 100
+MAX_SAMPLE_COUNT = 10 ** 7
+
+
+class RequestError(Exception):
+    pass
+
+
+def parse_min_max_reqs(raw, name='min_max_reqs'):
+    """
+    Returns the tightened `raw`, or None if no hand satisfies its suit lengths.
+    Impossible HPC are left for the table, which then is simply empty.
+    """
+    if not isinstance(raw, list) or len(raw) != 10 or not all(isinstance(x, int) for x in raw):
+        raise RequestError('{} must be a list of 10 integers'.format(name))
+    try:
+        return deal_stream.tighten(tuple(raw[:8])) + tuple(raw[8:])
+    except ValueError:
+        return None
+
+
+def get_event_table(min_max_reqs):
+    # Unsatisfiable constraints have probability zero, like impossible HPC.
+    return dict() if min_max_reqs is None else get_count_table(min_max_reqs)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def get_count_table(min_max_reqs):
+    # Keys are (c, d, h, s, hpc), values are numbers of hands.
+    return hpc_sampler.compute_table_4suits_hpc(min_max_reqs)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def get_sampler(min_max_reqs, seats):
+    if min_max_reqs is None or not get_count_table(min_max_reqs):
+        raise RequestError('min_max_reqs cannot be satisfied')
+    return deal_stream.prepare(min_max_reqs, seats=seats)
+
+
+def handle_probability(request):
+    event = get_event_table(parse_min_max_reqs(request.get('min_max_reqs')))
+    if 'given' in request:
+        given = get_event_table(parse_min_max_reqs(request['given'], 'given'))
+        # Only count the part of the event that is within `given`:
+        numerator = sum(v for k, v in event.items() if k in given)
+        denominator = sum(given.values())
+        if denominator == 0:
+            raise RequestError('given cannot be satisfied')
+        p = fractions.Fraction(numerator, denominator)
+    else:
+        p = table.count_probability(event)
+    return {'numerator': p.numerator, 'denominator': p.denominator, 'float': float(p)}
+
+
+async def handle_sample(request, send):
+    min_max_reqs = parse_min_max_reqs(request.get('min_max_reqs'))
+    count = request.get('count', 1)
+    if not isinstance(count, int) or not 0 <= count <= MAX_SAMPLE_COUNT:
+        raise RequestError('count must be an integer between 0 and {}'.format(MAX_SAMPLE_COUNT))
+    fmt = request.get('format', 'str')
+    if fmt not in formats.TEXT_FORMATS:
+        raise RequestError('format must be one of {}'.format(', '.join('"{}"'.format(f) for f in formats.TEXT_FORMATS)))
+    seats = request.get('seats', 'NESW')
+    if seats not in common.SEATS:
+        raise RequestError('seats must be one of {}'.format(', '.join('"{}"'.format(s) for s in common.SEATS)))
+    sampler = get_sampler(min_max_reqs, seats)
+    remaining = count
+    while remaining > 0:
+        deals, _, _ = deal_stream.sample_batch(sampler, min(remaining, SAMPLE_CHUNK_SIZE))
+        # 'int' stays a JSON list, the others are one line of text per deal.
+        lines = deals if fmt == 'int' else formats.format_deals(deals, fmt).decode().splitlines()
+        for line in lines:
+            await send({'deal': line}, drain=False)
+        remaining -= SAMPLE_CHUNK_SIZE
+        # Wait until the client has read enough, and let other requests run.
+        await send(None)
+        await asyncio.sleep(0)
+    await send({'done': True})
+
+
+async def handle_request(line, writer):
+    request_id = None
+
+    async def send(response, drain=True):
+        if response is not None:
+            response = dict(response, id=request_id)
+            writer.write(json.dumps(response, ensure_ascii=False).encode() + b'\n')
+        if drain:
+            await writer.drain()
+
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise RequestError('request must be a JSON object')
+        request_id = request.get('id')
+        op = request.get('op')
+        if op == 'probability':
+            await send(handle_probability(request))
+        elif op == 'sample':
+            await handle_sample(request, send)
+        else:
+            raise RequestError('unknown op {!r}'.format(op))
+    except (RequestError, ValueError) as e:
+        await send({'error': str(e)})
+    except ConnectionError:
+        pass
+    except Exception as e:
+        # A bug. Keep serving, but make sure the client doesn't wait forever.
+        traceback.print_exc(file=sys.stderr)
+        try:
+            await send({'error': 'internal error: {}: {}'.format(type(e).__name__, e)})
+        except ConnectionError:
+            pass
+
+
+async def handle_connection(reader, writer):
+    tasks = set()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            task = asyncio.ensure_future(handle_request(line, writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_socket(path):
+    server = await asyncio.start_unix_server(handle_connection, path=path)
+    print('Listening on {}'.format(path), file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+class StdinReader:
+    # Like asyncio.StreamReader, but works for any kind of stdin (including files).
+    async def readline(self):
+        return await asyncio.get_running_loop().run_in_executor(None, sys.stdin.buffer.readline)
+
+
+class StdoutWriter:
+    # Like asyncio.StreamWriter, but works for any kind of stdout (including files).
+    def write(self, data):
+        sys.stdout.buffer.write(data)
+
+    async def drain(self):
+        sys.stdout.buffer.flush()
+
+    def close(self):
+        sys.stdout.buffer.flush()
+
+
+async def serve_stdin():
+    await handle_connection(StdinReader(), StdoutWriter())
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--stdin']:
+        asyncio.run(serve_stdin())
+    elif len(sys.argv) == 3 and sys.argv[1] == '--socket':
+        try:
+            asyncio.run(serve_socket(sys.argv[2]))
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(USAGE.format(sys.argv[0]), file=sys.stderr)
+        exit(1)
@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
+import bisect
 import collections
+import collections.abc
 import common
 import fractions
+import functools
+import itertools
 import json
 import math
+import multiprocessing
 import os
-import secrets
+import randomness
 
 
 CHI_QUANTILE_STEPS = [0.002, 0.02, 0.05, 0.1, 0.2, 0.8, 0.9, 0.95, 0.98, 0.998]
@@ -89,11 +94,580 @@ def compute_table_4suits():
     return table
 
 
+# Evaluators assign points to the part of a hand within a single suit. They are
+# called as evaluator(suit_idx, length, honors), where `honors` is a bitmask of
+# the honors held in that suit (see common.honors_hpc()). Since only the *number*
+# of spot cards matters, the tables below can be computed by a small dynamic
+# program over the suits, instead of enumerating all hands.
+
+def evaluate_hpc(suit_idx, length, honors):
+    return common.honors_hpc(honors)
+
+
+def evaluate_controls(suit_idx, length, honors):
+    # Ace counts 2, King counts 1
+    return 2 * bool(honors & 0b1000) + bool(honors & 0b0100)
+
+
+def evaluate_honors(suit_idx, length, honors):
+    return common.honors_count(honors)
+
+
+@functools.lru_cache(maxsize=None)
+def make_evaluate_honors_in_suit(suit):
+    # Always the same function for a suit, so that the memoized tables are reused.
+    def evaluate_honors_in_suit(suit_idx, length, honors):
+        return common.honors_count(honors) if suit_idx == suit else 0
+    return evaluate_honors_in_suit
+
+
+def compute_suit_points_counts(suit_idx, evaluators):
+    """
+    Returns a list indexed by suit length, each entry a dict mapping
+    (points_1, points_2, ...) to the number of holdings in a single suit with that
+    length and these points.
+    """
+    spots = 13 - common.HONORS_PER_SUIT
+    counts = [collections.defaultdict(int) for _ in range(13 + 1)]
+    for honors in range(1 << common.HONORS_PER_SUIT):
+        num_honors = common.honors_count(honors)
+        for num_spots in range(spots + 1):
+            length = num_honors + num_spots
+            points = tuple(evaluator(suit_idx, length, honors) for evaluator in evaluators)
+            counts[length][points] += common.binomial(spots, num_spots)
+    return counts
+
+
+def combine_points_counts(counts_a, counts_b):
+    result = collections.defaultdict(int)
+    for points_a, count_a in counts_a.items():
+        for points_b, count_b in counts_b.items():
+            result[tuple(a + b for a, b in zip(points_a, points_b))] += count_a * count_b
+    return result
+
+
+def count_table_4suits_points(*evaluators):
+    """
+    Returns a table mapping (c, d, h, s, points_1, points_2, ...) to the number
+    of North hands with exactly these suit lengths and points.
+    The result is a *new* dict, but the computation is memoized per evaluators.
+    """
+    return dict(memoized_count_table_4suits_points(evaluators))
+
+
+@functools.lru_cache(maxsize=32)
+def memoized_count_table_4suits_points(evaluators):
+    suit_counts = [compute_suit_points_counts(suit_idx, evaluators) for suit_idx in range(4)]
+    # Combine clubs with diamonds, and hearts with spades, then combine the
+    # two halves. Each half is keyed by its two lengths.
+    halves = []
+    for first, second in [(0, 1), (2, 3)]:
+        half = dict()
+        for counts in gen_2suits_counts():
+            half[counts] = combine_points_counts(suit_counts[first][counts[0]], suit_counts[second][counts[1]])
+        halves.append(half)
+    table = dict()
+    for cdhs_counts in gen_4suits_counts():
+        combined = combine_points_counts(halves[0][cdhs_counts[:2]], halves[1][cdhs_counts[2:]])
+        for points, count in combined.items():
+            table[cdhs_counts + points] = count
+    return table
+
+
+def compute_table_4suits_points(*evaluators):
+    """
+    Like compute_table_4suits(), but the keys have additional entries for the
+    points as computed by each of the given evaluators. For example, with
+    evaluate_hpc the keys are (c, d, h, s, hpc), and filter_table(table, 4, 15, 17)
+    keeps only hands with 15-17 HPC.
+    """
+    assert len(evaluators) > 0
+    return dict(memoized_compute_table_4suits_points(evaluators))
+
+
+@functools.lru_cache(maxsize=32)
+def memoized_compute_table_4suits_points(evaluators):
+    table = dict()
+    denom = common.binomial(52, 13)
+    akku = 0
+    for key, count in memoized_count_table_4suits_points(evaluators).items():
+        table[key] = fractions.Fraction(count, denom)
+        akku += count
+    assert akku == denom, akku
+    return table
+
+
+# Integer tables: Instead of probabilities, these count the *number of hands*.
+# All of them share the implicit denominator HANDS_TOTAL, so summing, filtering
+# and collapsing never needs any gcd; only the final answer becomes a Fraction.
+# filter_table() and collapse() work on them just like on the Fraction tables.
+
+HANDS_TOTAL = common.binomial(52, 13)
+
+
+def count_table_1suit():
+    return {(i,): common.binomial(13, i) * common.binomial(52 - 13, 13 - i) for i in range(13 + 1)}
+
+
+def count_table_2suits():
+    return {suit_counts: common.hand_2suit_count(*suit_counts) for suit_counts in gen_2suits_counts()}
+
+
+def count_table_4suits():
+    # Same as common.hand_4suit_count(), but without recomputing the binomials.
+    b = [common.binomial(13, i) for i in range(13 + 1)]
+    return {(c, d, h, s): b[c] * b[d] * b[h] * b[s] for c, d, h, s in gen_4suits_counts()}
+
+
+def count_probability(count_table, total=HANDS_TOTAL):
+    """
+    Returns the total probability of an integer table, as a Fraction.
+    For joint tables of several hands, pass total=hands_total(num_hands).
+    """
+    if isinstance(count_table, JointTable):
+        return fractions.Fraction(count_table.total(), total)
+    return fractions.Fraction(sum(count_table.values()), total)
+
+
+def count_conditional_probability(count_table_event, count_table_given):
+    """
+    Returns P(event | given), as a Fraction. `count_table_event` should be a
+    filtered version of `count_table_given`.
+    """
+    return fractions.Fraction(sum(count_table_event.values()), sum(count_table_given.values()))
+
+
+def counts_to_fractions(count_table):
+    """
+    Returns a *new* table with the probability of each entry, as in compute_table_*().
+    """
+    return {k: fractions.Fraction(v, HANDS_TOTAL) for k, v in count_table.items()}
+
+
+# Joint tables of several hands: Keys are the suit lengths of each hand, one
+# after another, so (c0, d0, h0, s0, c1, d1, h1, s1, ...). Hence filter_table(table,
+# 4 * hand + suit, ...) filters by one hand's suit. Values count the ways to deal
+# these hands. All hands are alike, so a table for 2 hands can be read as North
+# and South just as well as North and East.
+
+def hands_total(num_hands):
+    """
+    Returns the number of ways to deal `num_hands` hands, i.e. the denominator of
+    count_table_hands(num_hands).
+    """
+    assert 1 <= num_hands <= 4
+    total = 1
+    for hand in range(num_hands):
+        total *= common.binomial(52 - 13 * hand, 13)
+    return total
+
+
+# Tables with more entries are not built as a dict, see JointTable. (All 3 hands
+# have 37478624 entries, which wouldn't fit into memory as a dict.)
+MAX_JOINT_DICT_ENTRIES = 10 ** 6
+
+
+# BINOMIALS[n][k] == common.binomial(n, k), for dealing from at most 13 cards of a suit
+BINOMIALS = tuple(tuple(common.binomial(n, k) for k in range(n + 1)) for n in range(13 + 1))
+
+
+def prepare_hands_state(min_max_reqs_per_hand):
+    """
+    Returns the state for counting the ways to deal several hands (one after
+    another), each constrained by 8 integers (2 for each suit) or None. All
+    counts are memoized in the state, by hand and the remaining cards per suit.
+    Many ways to deal the first hands leave the same remaining cards, so each of
+    these is only looked at once. With 4 hands, the last one gets whatever is left.
+    """
+    assert 1 <= len(min_max_reqs_per_hand) <= 4
+    shapes_by_hand = []
+    for hand_reqs in min_max_reqs_per_hand:
+        shapes = list(gen_4suits_counts())
+        if hand_reqs is not None:
+            assert len(hand_reqs) == 8
+            shapes = [shape for shape in shapes if all(hand_reqs[2 * i] <= shape[i] <= hand_reqs[2 * i + 1] for i in range(4))]
+        shapes_by_hand.append(shapes)
+    return {
+        'shapes_by_hand': shapes_by_hand,
+        'shape_sets': [frozenset(shapes) for shapes in shapes_by_hand],
+        'counts': dict(),
+    }
+
+
+def gen_hands_options(state, hand, remaining):
+    """
+    Yields (shape, ways, new_remaining) for each shape of `hand` that can be dealt
+    from the `remaining` cards (in `ways` ways), such that the later hands can
+    still be completed.
+    """
+    if hand == 3:
+        # West gets whatever is left.
+        if remaining in state['shape_sets'][3]:
+            yield remaining, 1, (0, 0, 0, 0)
+        return
+    last = hand + 1 == len(state['shapes_by_hand'])
+    b = BINOMIALS
+    rc, rd, rh, rs = remaining
+    for shape in state['shapes_by_hand'][hand]:
+        c, d, h, s = shape
+        if c <= rc and d <= rd and h <= rh and s <= rs:
+            new_remaining = (rc - c, rd - d, rh - h, rs - s)
+            if last or count_hands(state, hand + 1, new_remaining)[0] > 0:
+                yield shape, b[rc][c] * b[rd][d] * b[rh][h] * b[rs][s], new_remaining
+
+
+def count_hands(state, hand, remaining):
+    """
+    Returns (ways, shapes): The number of ways to deal the hands `hand`, `hand + 1`,
+    ... of the state from the `remaining` cards, such that all their constraints
+    are satisfied, and the number of different shapes these hands can have.
+    """
+    if hand == len(state['shapes_by_hand']):
+        return 1, 1
+    key = (hand, remaining)
+    counts = state['counts'].get(key)
+    if counts is None:
+        ways = 0
+        shapes = 0
+        if hand + 1 == len(state['shapes_by_hand']) and hand < 3:
+            # Like below, but inlined for the innermost loop.
+            b = BINOMIALS
+            rc, rd, rh, rs = remaining
+            for c, d, h, s in state['shapes_by_hand'][hand]:
+                if c <= rc and d <= rd and h <= rh and s <= rs:
+                    ways += b[rc][c] * b[rd][d] * b[rh][h] * b[rs][s]
+                    shapes += 1
+        else:
+            for _, shape_ways, new_remaining in gen_hands_options(state, hand, remaining):
+                completions, completion_shapes = count_hands(state, hand + 1, new_remaining)
+                ways += shape_ways * completions
+                shapes += completion_shapes
+        counts = state['counts'][key] = (ways, shapes)
+    return counts
+
+
+class JointTable(collections.abc.Mapping):
+    """
+    A joint table of several hands, see count_table_hands(). Behaves like a
+    read-only dict, but only generates the entries while iterating over them, so
+    that they never need to be in memory at once. filter_table(), collapse() etc.
+    work on it as on any table, and return a dict. Iterating is about as slow as
+    building a dict with all entries, so only do it once if possible.
+    """
+
+    def __init__(self, min_max_reqs):
+        # One entry per hand, as for count_table_hands(), but a hashable tuple
+        self.num_hands = len(min_max_reqs)
+        self.state = memoized_hands_state(min_max_reqs)
+
+    def __len__(self):
+        return count_hands(self.state, 0, (13, 13, 13, 13))[1]
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple) or len(key) != 4 * self.num_hands:
+            raise KeyError(key)
+        remaining = (13, 13, 13, 13)
+        count = 1
+        for hand in range(self.num_hands):
+            shape = key[4 * hand:4 * hand + 4]
+            if shape not in self.state['shape_sets'][hand] or not all(length <= left for length, left in zip(shape, remaining)):
+                raise KeyError(key)
+            count *= BINOMIALS[remaining[0]][shape[0]] * BINOMIALS[remaining[1]][shape[1]] * BINOMIALS[remaining[2]][shape[2]] * BINOMIALS[remaining[3]][shape[3]]
+            remaining = tuple(left - length for left, length in zip(remaining, shape))
+        return count
+
+    def items(self):
+        state = self.state
+        last = self.num_hands - 1
+        b = BINOMIALS
+
+        def recurse(hand, key, remaining, count):
+            if hand == last and hand < 3:
+                # Like gen_hands_options(), but inlined for the innermost loop.
+                rc, rd, rh, rs = remaining
+                for shape in state['shapes_by_hand'][hand]:
+                    c, d, h, s = shape
+                    if c <= rc and d <= rd and h <= rh and s <= rs:
+                        yield key + shape, count * b[rc][c] * b[rd][d] * b[rh][h] * b[rs][s]
+                return
+            if hand == last:
+                for shape, ways, _ in gen_hands_options(state, hand, remaining):
+                    yield key + shape, count * ways
+                return
+            for shape, ways, new_remaining in gen_hands_options(state, hand, remaining):
+                yield from recurse(hand + 1, key + shape, new_remaining, count * ways)
+
+        return recurse(0, (), (13, 13, 13, 13), 1)
+
+    def values(self):
+        return (count for _, count in self.items())
+
+    def total(self):
+        """
+        Returns sum(self.values()), without iterating.
+        """
+        return count_hands(self.state, 0, (13, 13, 13, 13))[0]
+
+
+def count_table_hands(num_hands, min_max_reqs=None):
+    """
+    Returns the joint table of the suit lengths of `num_hands` hands.
+    `min_max_reqs`, if given, is a list with one entry per hand, each either None
+    (no restriction) or 8 integers, 2 for each suit. Restricting early is much
+    faster than filtering the (huge) complete table afterwards.
+    The result is a *new* dict, but the computation is memoized. Tables with more
+    than MAX_JOINT_DICT_ENTRIES entries are returned as a JointTable instead.
+    """
+    assert 1 <= num_hands <= 4
+    if min_max_reqs is None:
+        min_max_reqs = [None] * num_hands
+    assert len(min_max_reqs) == num_hands
+    key = tuple(None if hand_reqs is None else tuple(hand_reqs) for hand_reqs in min_max_reqs)
+    joint = JointTable(key)
+    if len(joint) > MAX_JOINT_DICT_ENTRIES:
+        return joint
+    return dict(memoized_count_table_hands(num_hands, key))
+
+
+@functools.lru_cache(maxsize=32)
+def memoized_hands_state(min_max_reqs):
+    return prepare_hands_state(min_max_reqs)
+
+
+@functools.lru_cache(maxsize=32)
+def memoized_count_table_hands(num_hands, min_max_reqs):
+    return dict(JointTable(min_max_reqs).items())
+
+
+def filter_table_by(table, predicate):
+    """
+    Returns a *new* table with only those entries whose key satisfies `predicate`.
+    """
+    return {k: v for k, v in table.items() if predicate(k)}
+
+
+def filter_table_sum(table, indices, count_min, count_max):
+    """
+    Like filter_table(), but for the sum of several entries of the key. For
+    example, filter_table_sum(table, [3, 7], 8, 13) on a 2-hand table keeps only
+    those entries where the two hands have at least 8 spades together.
+    """
+    return {k: v for k, v in table.items() if count_min <= sum(k[i] for i in indices) <= count_max}
+
+
+# Tables given known cards: When some cards are already known (e.g. our own hand,
+# and maybe dummy), the unseen hands are dealt from what is left. A "residual deck"
+# describes what is left, as a tuple with one (honors, num_spots) pair per suit,
+# where `honors` is a bitmask as in common.honors_hpc(). The full deck is
+# FULL_RESIDUAL_DECK. The distribution of one unseen hand only depends on the
+# residual deck and the size of that hand; if there are only two unseen hands, the
+# other one simply holds the rest.
+
+FULL_RESIDUAL_DECK = (((1 << common.HONORS_PER_SUIT) - 1, 13 - common.HONORS_PER_SUIT),) * 4
+
+
+def residual_deck(known_cards):
+    """
+    Returns the residual deck after removing `known_cards` (card indices, see
+    common.card_to_string()) from the full deck.
+    """
+    residual = [list(entry) for entry in FULL_RESIDUAL_DECK]
+    for card in set(known_cards):
+        suit_idx, rank = common.card_suit(card), common.card_rank(card)
+        if rank >= 13 - common.HONORS_PER_SUIT:
+            residual[suit_idx][0] &= ~(1 << (rank - (13 - common.HONORS_PER_SUIT)))
+        else:
+            residual[suit_idx][1] -= 1
+    return tuple(tuple(entry) for entry in residual)
+
+
+def residual_total(residual, hand_size):
+    """
+    Returns the number of ways to pick a hand of `hand_size` cards from the
+    residual deck, i.e. the denominator of count_table_residual().
+    """
+    return common.binomial(sum(common.honors_count(honors) + num_spots for honors, num_spots in residual), hand_size)
+
+
+@functools.lru_cache(maxsize=None)
+def compute_residual_suit_points_counts(suit_idx, honors_left, spots_left, evaluators):
+    # Like compute_suit_points_counts(), but only with the given cards left in the suit.
+    counts = [collections.defaultdict(int) for _ in range(13 + 1)]
+    for honors in range(1 << common.HONORS_PER_SUIT):
+        if honors & ~honors_left:
+            continue
+        num_honors = common.honors_count(honors)
+        for num_spots in range(spots_left + 1):
+            length = num_honors + num_spots
+            points = tuple(evaluator(suit_idx, length, honors) for evaluator in evaluators)
+            counts[length][points] += common.binomial(spots_left, num_spots)
+    return counts
+
+
+def count_table_residual(residual, hand_size=13, *evaluators):
+    """
+    Returns a table mapping (c, d, h, s, points_1, points_2, ...) to the number of
+    hands with `hand_size` cards from the residual deck that have exactly these
+    suit lengths and points. Divide by residual_total(residual, hand_size) (or pass
+    that as `total` to count_probability()) for probabilities.
+    The result is a *new* dict, but the computation is memoized per residual deck.
+    """
+    assert len(residual) == 4
+    residual = tuple((honors, num_spots) for honors, num_spots in residual)
+    return dict(memoized_count_table_residual(residual, hand_size, evaluators))
+
+
+@functools.lru_cache(maxsize=256)
+def memoized_count_table_residual(residual, hand_size, evaluators):
+    suit_counts = [compute_residual_suit_points_counts(suit_idx, honors, num_spots, evaluators)
+                   for suit_idx, (honors, num_spots) in enumerate(residual)]
+    suit_sizes = [common.honors_count(honors) + num_spots for honors, num_spots in residual]
+    # Same as in memoized_count_table_4suits_points(), but lengths are bounded by
+    # what is left in each suit, and must add up to `hand_size`.
+    halves = []
+    for first, second in [(0, 1), (2, 3)]:
+        half = dict()
+        for length_a in range(min(suit_sizes[first], hand_size) + 1):
+            for length_b in range(min(suit_sizes[second], hand_size - length_a) + 1):
+                half[(length_a, length_b)] = combine_points_counts(suit_counts[first][length_a], suit_counts[second][length_b])
+        halves.append(half)
+    table = dict()
+    for lengths_a, points_a in halves[0].items():
+        for lengths_b, points_b in halves[1].items():
+            if sum(lengths_a) + sum(lengths_b) != hand_size:
+                continue
+            for points, count in combine_points_counts(points_a, points_b).items():
+                table[lengths_a + lengths_b + points] = count
+    return table
+
+
+# Exact counts for arbitrary predicates on North's hand. A predicate is called
+# as predicate(lengths, honors), with the suit lengths (c, d, h, s) and the
+# honors held in each suit as bitmasks (see common.honors_hpc()), and returns
+# whether the hand counts. Like the evaluators above, it can't see *which* spot
+# cards North holds, only how many. So it's enough to evaluate it once for each
+# of the 2 ** 16 honor sets and each way to fill up with spot cards, weighted
+# by the number of such hands: About 5 million classes instead of 635 billion
+# hands. Predicates must be module-level functions to use workers > 1.
+#
+# Many predicates don't look at the lengths at all. Marked with @honors_only,
+# they are called as predicate(None, honors), once for each of the 2 ** 16 honor
+# sets, which takes a fraction of a second instead of half a minute.
+
+# predicate -> number of North hands satisfying it, see count_predicate(). Keyed
+# by the function object, so only named functions are memoized: A lambda is a
+# new object each time its expression runs, and would never be found again.
+predicate_counts = dict()
+
+
+def honors_only(predicate):
+    """
+    Marks `predicate` as only depending on the honors, see above.
+    """
+    predicate.honors_only = True
+    return predicate
+
+
+@honors_only
+def predicate_both_black_aces(lengths, honors):
+    return bool(honors[0] & honors[3] & 0b1000)
+
+
+def predicate_singleton_honor(lengths, honors):
+    return any(length == 1 and suit_honors for length, suit_honors in zip(lengths, honors))
+
+
+@honors_only
+def predicate_akq_in_some_suit(lengths, honors):
+    return any(suit_honors & 0b1110 == 0b1110 for suit_honors in honors)
+
+
+@honors_only
+def predicate_hpc_15_17(lengths, honors):
+    return 15 <= sum(common.honors_hpc(suit_honors) for suit_honors in honors) <= 17
+
+
+@functools.lru_cache(maxsize=None)
+def compute_spot_classes(honor_counts):
+    """
+    Returns a tuple of (lengths, count): For each way to fill up a hand with
+    `honor_counts` honors per suit to 13 cards with spot cards, the resulting
+    suit lengths and the number of ways to pick these spot cards.
+    """
+    spots = 13 - common.HONORS_PER_SUIT
+    num_spots = 13 - sum(honor_counts)
+    classes = []
+    for spots_cdh in itertools.product(range(spots + 1), repeat=3):
+        spots_s = num_spots - sum(spots_cdh)
+        if not 0 <= spots_s <= spots:
+            continue
+        spot_counts = spots_cdh + (spots_s,)
+        count = 1
+        for num in spot_counts:
+            count *= common.binomial(spots, num)
+        classes.append((tuple(num_honors + num for num_honors, num in zip(honor_counts, spot_counts)), count))
+    return tuple(classes)
+
+
+def count_predicate_chunk(predicate, honors_c, honors_d):
+    # All classes with these honors in clubs and diamonds
+    spots = 4 * (13 - common.HONORS_PER_SUIT)
+    honors_only = getattr(predicate, 'honors_only', False)
+    count = 0
+    for honors_h in range(1 << common.HONORS_PER_SUIT):
+        for honors_s in range(1 << common.HONORS_PER_SUIT):
+            honors = (honors_c, honors_d, honors_h, honors_s)
+            honor_counts = tuple(common.honors_count(suit_honors) for suit_honors in honors)
+            if sum(honor_counts) > 13:
+                continue
+            if honors_only:
+                # The same for all classes, which together are any 13 - honors spot cards.
+                if predicate(None, honors):
+                    count += common.binomial(spots, 13 - sum(honor_counts))
+                continue
+            for lengths, class_count in compute_spot_classes(honor_counts):
+                if predicate(lengths, honors):
+                    count += class_count
+    return count
+
+
+def count_predicate(predicate, workers=1):
+    """
+    Returns the exact number of North hands for which `predicate` is true (see
+    above). The computation is split across `workers` processes, and memoized
+    per predicate, unless it is a lambda (see predicate_counts).
+    """
+    if predicate in predicate_counts:
+        return predicate_counts[predicate]
+    chunks = [(predicate, honors_c, honors_d) for honors_c in range(1 << common.HONORS_PER_SUIT) for honors_d in range(1 << common.HONORS_PER_SUIT)]
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            count = sum(pool.starmap(count_predicate_chunk, chunks))
+    else:
+        count = sum(itertools.starmap(count_predicate_chunk, chunks))
+    if predicate.__name__ != '<lambda>':
+        predicate_counts[predicate] = count
+    return count
+
+
+def compute_probability_predicate(predicate, workers=1):
+    """
+    Returns the exact probability that North's hand satisfies `predicate`, as a Fraction.
+    """
+    return fractions.Fraction(count_predicate(predicate, workers), HANDS_TOTAL)
+
+
 def run_sanity_checks():
     print('Running sanity checks ...')
     print('  Checking chi square critical values table ...')
-    for q_values in CHI_QUANTILE_VALUES.values():
+    for df, q_values in CHI_QUANTILE_VALUES.items():
         assert len(CHI_QUANTILE_STEPS) == len(q_values)
+        for q, value in zip(CHI_QUANTILE_STEPS, q_values):
+            assert abs(chi_square_quantile(chi_quantile_level(q), df) - value) < 1e-3 * value, (q, df, value)
+    assert abs(chi_square_cdf(2, 2) - (1 - math.exp(-1))) < 1e-12
     print('  Checking 1 suit table ...')
     assert len(compute_table_1suit()) == 13 + 1
     assert 13 in CHI_QUANTILE_VALUES
@@ -103,15 +677,87 @@ def run_sanity_checks():
     print('  Checking 4 suits table ...')
     assert len(compute_table_4suits()) == 560
     assert (560 - 1) in CHI_QUANTILE_VALUES
+    print('  Checking integer tables ...')
+    assert counts_to_fractions(count_table_1suit()) == compute_table_1suit()
+    assert counts_to_fractions(count_table_2suits()) == compute_table_2suits()
+    assert counts_to_fractions(count_table_4suits()) == compute_table_4suits()
+    assert sum(count_table_4suits().values()) == HANDS_TOTAL
+    print('  Checking joint hands tables ...')
+    assert hands_total(1) == HANDS_TOTAL
+    assert count_table_hands(1) == count_table_4suits()
+    two_hands = count_table_hands(2)
+    assert sum(two_hands.values()) == hands_total(2)
+    assert collapse(two_hands, [True] * 4 + [False] * 4) == {k: v * common.binomial(39, 13) for k, v in count_table_4suits().items()}
+    assert len(count_table_hands(4, [(5, 5, 3, 3, 3, 3, 2, 2), (4, 4, 4, 4, 4, 4, 1, 1), None, None])) > 0
+    everything = count_table_hands(4, [(13, 13, 0, 0, 0, 0, 0, 0), None, None, None])
+    assert sum(everything.values()) == common.binomial(39, 13) * common.binomial(26, 13)
+    # 4 hands with only North restricted: Each of North's shapes, with any deal of the other 39 cards.
+    north_reqs = (1, 3, 3, 5, 3, 7, 3, 6)
+    assert JointTable((north_reqs, None, None, None)).total() == sum(compute_table_4suits_int(north_reqs).values()) * hands_total(3) // HANDS_TOTAL
+    assert JointTable(((3, 3, 3, 3, 3, 3, 4, 4), None, None, None)).total() == count_table_4suits()[(3, 3, 3, 4)] * hands_total(3) // HANDS_TOTAL
+    # Too large for a dict, but counting is still quick.
+    three_hands = count_table_hands(3)
+    assert isinstance(three_hands, JointTable) and len(three_hands) == 37478624
+    assert count_probability(three_hands, hands_total(3)) == 1
+    assert three_hands[(13, 0, 0, 0, 0, 13, 0, 0, 0, 0, 13, 0)] == 1 and (13, 0, 0, 0) * 3 not in three_hands
+    north_5332 = JointTable(((5, 5, 3, 3, 3, 3, 2, 2), None))
+    assert north_5332 == filter_table_by(two_hands, lambda key: key[:4] == (5, 3, 3, 2))
+    print('  Checking predicate counts ...')
+    assert compute_probability_predicate(predicate_both_black_aces) == fractions.Fraction(common.binomial(50, 11), HANDS_TOTAL)
+    hpc_table = count_table_4suits_points(evaluate_hpc)
+    assert count_predicate(predicate_hpc_15_17) == sum(filter_table(hpc_table, 4, 15, 17).values())
+    assert predicate_hpc_15_17 in predicate_counts
+    # Inclusion-exclusion over the suits with AKQ
+    assert count_predicate(predicate_akq_in_some_suit, workers=2) == \
+        sum((-1) ** (k + 1) * common.binomial(4, k) * common.binomial(52 - 3 * k, 13 - 3 * k) for k in range(1, 4 + 1))
+    print('  Checking residual deck tables ...')
+    assert residual_deck([]) == FULL_RESIDUAL_DECK
+    assert count_table_residual(FULL_RESIDUAL_DECK) == count_table_4suits()
+    assert count_table_residual(FULL_RESIDUAL_DECK, 13, evaluate_hpc) == count_table_4suits_points(evaluate_hpc)
+    unseen = [0, 5, 11, 12, 25, 30, 38, 51]
+    residual = residual_deck(card for card in range(52) if card not in unseen)
+    brute_force = collections.defaultdict(int)
+    for hand in itertools.combinations(unseen, 3):
+        brute_force[tuple(sum(1 for card in hand if common.card_suit(card) == i) for i in range(4)) + (common.count_hpc(hand),)] += 1
+    assert count_table_residual(residual, 3, evaluate_hpc) == brute_force
+    assert sum(brute_force.values()) == residual_total(residual, 3)
+    print('  Checking deal ranks ...')
+    assert common.unrank_deal(0) == list(range(52))
+    for rank in [0, 1, 123456789 ** 3, common.DEALS_COUNT - 1]:
+        deal = common.unrank_deal(rank)
+        assert sorted(deal) == list(range(52))
+        assert common.rank_deal(deal) == rank
+        assert common.decode_deal_bin12(common.format_deal(deal, 'bin12')) == deal
+        assert common.unrank_hand(common.rank_hand(deal[13:26])) == deal[13:26]
+    assert common.rank_hand(list(range(52 - 13, 52))) == common.HANDS_COUNT - 1
+    print('  Checking prepared sampler ...')
+    table_int = rescale_table_int(compute_table_4suits())
+    check_prepared_int(table_int)
+    check_prepared_int(rescale_table_int(filter_table(compute_table_4suits(), 3, 5, 7)))
+    check_prepared_int({(0,): 0, (1,): 3, (2,): 0, (3,): 1})
+    print('  Checking 4 suits points tables ...')
+    shapes = compute_table_4suits()
+    hpc_table = compute_table_4suits_points(evaluate_hpc)
+    assert collapse(hpc_table, [True] * 4 + [False]) == shapes
+    assert max(k[4] for k in hpc_table.keys()) == 37
+    assert sum(filter_table(hpc_table, 4, 37, 37).values()) == fractions.Fraction(4, common.binomial(52, 13))
+    both_table = compute_table_4suits_points(evaluate_hpc, evaluate_controls)
+    assert collapse(both_table, [True] * 5 + [False]) == hpc_table
+    assert set(collapse(both_table, [False] * 5 + [True]).keys()) == {(i,) for i in range(12 + 1)}
+    clubs_table = compute_table_4suits_points(make_evaluate_honors_in_suit(0))
+    for key in clubs_table.keys():
+        assert key[4] <= min(key[0], 4), key
+    # Memoized, as the evaluator is the same function each time:
+    assert make_evaluate_honors_in_suit(0) is make_evaluate_honors_in_suit(0)
+    assert memoized_compute_table_4suits_points((make_evaluate_honors_in_suit(0),)) is memoized_compute_table_4suits_points((make_evaluate_honors_in_suit(0),))
     print('  Done')
 
 
 def collapse(table_in, mask):
-    assert len(mask) == 4
     table_out = collections.defaultdict(int)
-    for foursuits_count, value in table_in.items():
-        assert len(foursuits_count) == 4
-        key = tuple(c for c, take in zip(foursuits_count, mask) if take)
+    for full_key, value in table_in.items():
+        assert len(full_key) == len(mask)
+        key = tuple(c for c, take in zip(full_key, mask) if take)
         table_out[key] += value
     return table_out
 
@@ -152,16 +798,151 @@ def rescale_table_int(table_in):
     return table_out
 
 
-def sample_table_int(table_int):
-    total = sum(table_int.values())
-    assert isinstance(total, int)
-    chosen = secrets.randbelow(total)
+def compute_table_4suits_int(min_max_reqs):
+    """
+    Returns the integer table (see count_table_4suits()) of all 4-suit counts within
+    `min_max_reqs`, which are 8 integers, 2 for each suit.
+    """
+    assert len(min_max_reqs) == 8
+    # Counts of hands are already integers, no need to rescale!
+    entries = count_table_4suits()
+    entries = filter_table(entries, 0, min_max_reqs[0], min_max_reqs[1])
+    entries = filter_table(entries, 1, min_max_reqs[2], min_max_reqs[3])
+    entries = filter_table(entries, 2, min_max_reqs[4], min_max_reqs[5])
+    entries = filter_table(entries, 3, min_max_reqs[6], min_max_reqs[7])
+    return entries
+
+
+def lookup_table_int(table_int, chosen):
     remaining = chosen
     for k, v in table_int.items():
         if remaining < v:
             return k
         remaining -= v
-    raise AssertionError('Still have {} remaining after chose {} out of {}?!'.format(remaining, chosen, total))
+    raise AssertionError('Still have {} remaining after chose {} out of {}?!'.format(remaining, chosen, sum(table_int.values())))
+
+
+def sample_table_int(table_int):
+    total = sum(table_int.values())
+    assert isinstance(total, int)
+    return lookup_table_int(table_int, randomness.randbelow(total))
+
+
+def prepare_table_int(table_int):
+    """
+    Returns a sampler for the given integer table (as returned by rescale_table_int()).
+    Build it once, then call sample_prepared_int() for each sample.
+    The sampler is a tuple (keys, cumulative), where cumulative[i] is the sum of all
+    weights up to and including keys[i]. Since everything stays an integer, the
+    distribution is *exactly* the same as with sample_table_int().
+    """
+    keys = []
+    cumulative = []
+    total = 0
+    for k, v in table_int.items():
+        assert isinstance(v, int) and v >= 0, (k, v)
+        if v == 0:
+            continue
+        total += v
+        keys.append(k)
+        cumulative.append(total)
+    assert total > 0, 'Cannot sample from an empty table'
+    return (tuple(keys), tuple(cumulative))
+
+
+def lookup_prepared_int(prepared, chosen):
+    keys, cumulative = prepared
+    assert 0 <= chosen < cumulative[-1], (chosen, cumulative[-1])
+    return keys[bisect.bisect_right(cumulative, chosen)]
+
+
+def sample_prepared_int(prepared):
+    return lookup_prepared_int(prepared, randomness.randbelow(prepared[1][-1]))
+
+
+def check_prepared_int(table_int):
+    # The samplers agree on the distribution iff they agree on every chosen
+    # number. Between two consecutive boundaries nothing changes, so checking
+    # both sides of every boundary is enough.
+    prepared = prepare_table_int(table_int)
+    total = prepared[1][-1]
+    assert total == sum(table_int.values())
+    for boundary in prepared[1]:
+        for chosen in (boundary - 1, boundary):
+            if chosen < total:
+                assert lookup_prepared_int(prepared, chosen) == lookup_table_int(table_int, chosen), chosen
+
+
+# The chi-squared distribution with `df` degrees of freedom has the CDF
+# P(df / 2, x / 2), where P is the regularized lower incomplete gamma function.
+# CHI_QUANTILE_VALUES is kept as a cross-check for this.
+
+def regularized_gamma_p(a, x):
+    """
+    Returns P(a, x) = gamma(a, x) / Gamma(a), for a > 0 and x >= 0.
+    """
+    assert a > 0 and x >= 0
+    if x == 0:
+        return 0.0
+    log_prefactor = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # Series expansion, converges quickly for small x.
+        term = 1 / a
+        total = term
+        n = 0
+        while abs(term) > abs(total) * 1e-16:
+            n += 1
+            term *= x / (a + n)
+            total += term
+        return total * math.exp(log_prefactor)
+    # Continued fraction for Q(a, x) = 1 - P(a, x), by the modified Lentz method.
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    n = 0
+    while True:
+        n += 1
+        an = -n * (n - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-16 or n > 10000:
+            break
+    return 1 - math.exp(log_prefactor) * h
+
+
+def chi_square_cdf(x, df):
+    return regularized_gamma_p(df / 2, x / 2)
+
+
+def chi_square_quantile(q, df):
+    """
+    Returns x such that chi_square_cdf(x, df) == q, for 0 < q < 1.
+    """
+    assert 0 < q < 1 and df > 0
+    low, high = 0.0, float(df)
+    while chi_square_cdf(high, df) < q:
+        high *= 2
+    for _ in range(100):
+        mid = (low + high) / 2
+        if chi_square_cdf(mid, df) < q:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+def chi_quantile_level(step):
+    # The steps in CHI_QUANTILE_STEPS are "from both sides": 0.05 means the
+    # lower 0.025-quantile, and 0.95 the upper 0.975-quantile.
+    return step / 2 if step < 0.5 else (1 + step) / 2
 
 
 def is_consistent(actual, total, expected):
@@ -198,8 +979,10 @@ def is_consistent(actual, total, expected):
         print('        To reach 95% >= 5, need n >= {} (5%-percentile is {})'.format(math.ceil(5 / q_0_05), q_0_05))
         print('        To reach 100% >= 5, need n >= {} (0%-percentile is {})'.format(math.ceil(5 / q_0_00), q_0_00))
     print('      For comparison:')
-    pairs = list(zip(CHI_QUANTILE_STEPS, CHI_QUANTILE_VALUES[len(actual) - 1]))
+    df = len(expected) - 1
+    pairs = list(zip(CHI_QUANTILE_STEPS, [round(chi_square_quantile(chi_quantile_level(q), df), 3) for q in CHI_QUANTILE_STEPS]))
     print('        {}'.format(' '.join('{}@{}'.format(q, v) for q, v in pairs)))
+    print('      p-value: {}'.format(1 - chi_square_cdf(float(chisq), df)))
     print('      checking {} < {} < {}'.format(pairs[QUANTILE_REQUIRE][1], chisq, pairs[-1 - QUANTILE_REQUIRE][1]))
     return pairs[QUANTILE_REQUIRE][1] < chisq < pairs[-1 - QUANTILE_REQUIRE][1]
 
@@ -253,7 +1036,8 @@ def parse_key(k):
 def run(filename):
     run_sanity_checks()
     with open(filename, 'r') as fp:
-        total, keyvals = json.load(fp)
+        # Newer files have more entries after these, see naive_sampler.py.
+        total, keyvals = json.load(fp)[:2]
     assert total == sum(keyvals.values())
     actual_table = {parse_key(k): v for k, v in keyvals.items()}
     run_consistency_checks(actual_table, total)
@@ -0,0 +1,101 @@
+#!/bin/false
+
+import common
+import hashlib
+import json
+import os
+import sys
+
+# On-disk cache for the integer tables that the samplers build at startup (and
+# for other startup work, like compiled constraints, see constraints.py).
+#
+# Enabled by setting the environment variable SCIENCE_BRIDGE_CACHE to a directory.
+# Each table is stored in its own JSON file, named after the kind of table and the
+# (already tightened) constraints. Files are written atomically, and carry a
+# checksum of their entries; a file that doesn't match is ignored and rewritten.
+
+CACHE_ENV_VAR = 'SCIENCE_BRIDGE_CACHE'
+# Bump whenever the meaning of the stored tables changes. 2: compute_table_4suits_int()
+# stores raw counts instead of LCM-scaled weights.
+CACHE_VERSION = 2
+# Longer keys (e.g. with many patterns) are hashed, to stay within file name limits.
+MAX_KEY_CHARS = 100
+
+
+def get_cache_dir():
+    return os.environ.get(CACHE_ENV_VAR) or None
+
+
+def cache_filename(cache_dir, kind, key):
+    key_text = '_'.join(str(x) for x in key)
+    if len(key_text) > MAX_KEY_CHARS:
+        # The full key is also stored in the file, so a collision is just a miss.
+        key_text = hashlib.sha256(key_text.encode()).hexdigest()
+    return os.path.join(cache_dir, 'table_{}_v{}_{}.json'.format(kind, CACHE_VERSION, key_text))
+
+
+def entries_checksum(entries):
+    return hashlib.sha256(json.dumps(entries, separators=(',', ':')).encode()).hexdigest()
+
+
+def table_to_entries(table_int):
+    return [list(k) + [v] for k, v in table_int.items()]
+
+
+def table_from_entries(entries):
+    return {tuple(entry[:-1]): entry[-1] for entry in entries}
+
+
+def encode_entry(kind, key, value, to_entries=table_to_entries):
+    entries = to_entries(value)
+    return json.dumps({
+        'version': CACHE_VERSION,
+        'kind': kind,
+        'key': list(key),
+        'entries': entries,
+        'sha256': entries_checksum(entries),
+    }, separators=(',', ':')).encode()
+
+
+def decode_entry(kind, key, data, from_entries=table_from_entries):
+    """
+    Returns the table (or other value), or None if `data` isn't a valid cache
+    entry for `kind` and `key`.
+    """
+    try:
+        parsed = json.loads(data)
+        if parsed['version'] != CACHE_VERSION or parsed['kind'] != kind or parsed['key'] != list(key):
+            return None
+        entries = parsed['entries']
+        if parsed['sha256'] != entries_checksum(entries):
+            return None
+        return from_entries(entries)
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def load_or_compute(kind, key, compute, to_entries=table_to_entries, from_entries=table_from_entries):
+    """
+    Returns the integer table for `kind` and `key` from the cache. If it's not
+    there (or broken, or caching is disabled), calls `compute()` and stores the result.
+    Other values can be cached by passing functions that convert them to and from
+    a JSON list, which must give back an equal value.
+    """
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return compute()
+    filename = cache_filename(cache_dir, kind, key)
+    try:
+        with open(filename, 'rb') as fp:
+            table_int = decode_entry(kind, key, fp.read(), from_entries)
+    except OSError:
+        table_int = None
+    if table_int is not None:
+        return table_int
+    table_int = compute()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        common.write_file_atomically(filename, encode_entry(kind, key, table_int, to_entries))
+    except OSError as e:
+        print('Cannot write table cache {}: {}'.format(filename, e), file=sys.stderr)
+    return table_int
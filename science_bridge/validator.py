@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import collections
+import common
+import deal_stream
+import formats
+import hpc_sampler
+import sys
+import table
+
+# Checks a stream of deals against the exact distribution of North's hand,
+# without storing the deals: Only the counts of North's (c, d, h, s, hpc) are
+# kept. The key is computed from the dealt cards, so this checks the whole path
+# from the table to the final deal.
+#
+# Works on the output of any sampler, for example:
+#     ./combined_sampler.py 0 2 3 4 3 5 3 5 26 30 100000 | ./validator.py 0 2 3 4 3 5 3 5 26 30
+# or from Python, by passing each batch of deal_stream.iter_deals() to add_deals().
+#
+# Several views of the counts are tested: the full key, only the suit lengths,
+# and only the HPC. For each, cells whose expected count is below MIN_EXPECTED are
+# pooled into a single cell, so that the chi-squared test stays meaningful.
+
+MIN_EXPECTED = 5
+ALPHA = 0.001
+REPORT_FRACTION = 10000
+PROJECTIONS = [
+    ('shape+hpc', [True] * 5),
+    ('shape', [True] * 4 + [False]),
+    ('hpc', [False] * 4 + [True]),
+]
+
+
+def new_validator(min_max_reqs):
+    """
+    `min_max_reqs` are 8 integers (suits only) or 10 integers (suits and HPC), as
+    for the samplers. Returns the validator state.
+    """
+    min_max_reqs = deal_stream.tighten(min_max_reqs)
+    if len(min_max_reqs) == 8:
+        min_max_reqs += (0, 37)
+    expected = hpc_sampler.compute_table_4suits_hpc(min_max_reqs)
+    expected_total = sum(expected.values())
+    if expected_total == 0:
+        raise ValueError('Constraints {} cannot be satisfied'.format(min_max_reqs))
+    return {
+        'projections': [(name, table.collapse(expected, mask), mask) for name, mask in PROJECTIONS],
+        'expected_total': expected_total,
+        'counts': collections.Counter(),
+        'total': 0,
+        'impossible': 0,
+    }
+
+
+def deal_key(deal):
+    north = deal[:13]
+    return tuple(sum(1 for card in north if common.card_suit(card) == suit) for suit in range(4)) + (common.count_hpc(north),)
+
+
+def add_deals(validator, deals):
+    projections = validator['projections']
+    counts = validator['counts']
+    for deal in deals:
+        key = deal_key(deal)
+        if key not in projections[0][1]:
+            validator['impossible'] += 1
+        counts[key] += 1
+    validator['total'] += len(deals)
+
+
+def chi_square_test(observed, expected, expected_total, n):
+    """
+    Returns a tuple (chisq, df, p_value), or None if there are not enough deals yet.
+    `expected` maps keys to integers, which are proportional to the probabilities.
+    """
+    chisq = 0.0
+    pooled_observed = 0
+    pooled_expected = 0.0
+    bins = 0
+    for key, weight in expected.items():
+        v_expected = n * weight / expected_total
+        if v_expected < MIN_EXPECTED:
+            pooled_observed += observed.get(key, 0)
+            pooled_expected += v_expected
+            continue
+        v_actual = observed.get(key, 0)
+        chisq += (v_actual - v_expected) ** 2 / v_expected
+        bins += 1
+    if pooled_expected > 0:
+        chisq += (pooled_observed - pooled_expected) ** 2 / pooled_expected
+        bins += 1
+    if bins < 2:
+        return None
+    df = bins - 1
+    return chisq, df, 1 - table.chi_square_cdf(chisq, df)
+
+
+def report(validator):
+    """
+    Returns a list of dicts, one per test, with the entries 'name', 'chisq',
+    'df' and 'p_value' (or None if there are not enough deals for that test yet).
+    """
+    n = validator['total']
+    results = []
+    for name, expected, mask in validator['projections']:
+        observed = table.collapse(validator['counts'], mask)
+        result = chi_square_test(observed, expected, validator['expected_total'], n) if n > 0 else None
+        if result is None:
+            results.append({'name': name, 'chisq': None, 'df': None, 'p_value': None})
+        else:
+            chisq, df, p_value = result
+            results.append({'name': name, 'chisq': chisq, 'df': df, 'p_value': p_value})
+    return results
+
+
+def is_ok(validator):
+    if validator['impossible'] > 0:
+        return False
+    return all(result['p_value'] is None or result['p_value'] >= ALPHA for result in report(validator))
+
+
+def print_report(validator, file=sys.stderr):
+    parts = ['{} deals'.format(validator['total'])]
+    if validator['impossible'] > 0:
+        parts.append('{} IMPOSSIBLE'.format(validator['impossible']))
+    for result in report(validator):
+        if result['p_value'] is None:
+            parts.append('{}: too few deals'.format(result['name']))
+        else:
+            parts.append('{}: p = {:.4f} (df {})'.format(result['name'], result['p_value'], result['df']))
+    print(', '.join(parts), file=file)
+
+
+def validate_batches(batches, validator, report_every=REPORT_FRACTION):
+    """
+    Passes through the batches of deals (e.g. from deal_stream.iter_deals()),
+    while adding them to `validator` and printing a report every `report_every` deals.
+    """
+    last_reported = 0
+    for deals in batches:
+        add_deals(validator, deals)
+        if validator['total'] - last_reported >= report_every:
+            print_report(validator)
+            last_reported = validator['total']
+        yield deals
+
+
+def read_deals(fp, fmt, batch_size=deal_stream.DEFAULT_BATCH_SIZE):
+    """
+    Yields batches of deals read from the binary file `fp`, written in the format `fmt`.
+    """
+    if fmt in common.BINARY_RECORD_SIZES:
+        decode = {'bin52': common.decode_deal_bin52, 'bin13': common.decode_deal_bin13, 'bin12': common.decode_deal_bin12}[fmt]
+        record_size = common.BINARY_RECORD_SIZES[fmt]
+        while True:
+            data = fp.read(record_size * batch_size)
+            if len(data) % record_size != 0:
+                raise ValueError('Input ends with a partial deal')
+            if not data:
+                return
+            yield [decode(data[offset:offset + record_size]) for offset in range(0, len(data), record_size)]
+    else:
+        deals = []
+        for line in fp:
+            if not line.strip():
+                continue
+            deals.append(formats.parse_deal(line.decode(), fmt))
+            if len(deals) == batch_size:
+                yield deals
+                deals = []
+        if deals:
+            yield deals
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    fmt = 'str'
+    if len(args) >= 2 and args[0] == '--format':
+        fmt = args[1]
+        args = args[2:]
+    if len(args) not in (8, 10) or fmt not in formats.FORMATS or fmt == 'None':
+        print('USAGE: {} [--format FORMAT] <MIN_MAX_REQS>'.format(sys.argv[0]), file=sys.stderr)
+        print('Reads deals from stdin, and checks that North\'s suit lengths and HPC follow', file=sys.stderr)
+        print('the exact distribution for MIN_MAX_REQS (8 or 10 integers, as for the samplers).', file=sys.stderr)
+        print('FORMAT is one of {} (default "str").'.format(', '.join('"{}"'.format(f) for f in formats.FORMATS if f != 'None')), file=sys.stderr)
+        print('Exits with status 1 if any test fails at alpha = {}.'.format(ALPHA), file=sys.stderr)
+        exit(1)
+    validator = new_validator(tuple(int(x) for x in args))
+    for _ in validate_batches(read_deals(sys.stdin.buffer, fmt), validator):
+        pass
+    if validator['total'] % REPORT_FRACTION != 0:
+        print_report(validator)
+    exit(0 if is_ok(validator) else 1)